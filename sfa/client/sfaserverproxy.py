@@ -38,6 +38,30 @@ class ExceptionUnmarshaller(xmlrpc.client.Unmarshaller):
 # targetting only python-2.7 we can get rid of some older code
 
 
+class HTTPSConnection(http.client.HTTPSConnection):
+    """
+    A HTTPS connection that can resume a previous TLS session
+    """
+
+    def __init__(self, *args, ssl_session=None, **kwds):
+        http.client.HTTPSConnection.__init__(self, *args, **kwds)
+        self.ssl_session = ssl_session
+
+    def connect(self):
+        # like http.client.HTTPSConnection.connect, with the session;
+        # this sets up the tunnel, if any, through the proxy
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self._tunnel_host or self.host,
+            session=self.ssl_session)
+
+    def close(self):
+        # remember the TLS session before the socket goes away
+        if self.sock is not None and self.sock.session is not None:
+            self.ssl_session = self.sock.session
+        http.client.HTTPSConnection.close(self)
+
+
 class XMLRPCTransport(xmlrpc.client.Transport):
 
     def __init__(self, key_file=None, cert_file=None, timeout=None):
@@ -45,14 +69,23 @@ class XMLRPCTransport(xmlrpc.client.Transport):
         self.timeout = timeout
         self.key_file = key_file
         self.cert_file = cert_file
+        self.context = simple_ssl_context()
+        # host -> TLS session of the last connection, for resuming it
+        self.ssl_sessions = {}
 
     def make_connection(self, host):
+        # like xmlrpc.client.Transport, reuse the connection to the same
+        # host as long as the server keeps it open
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
         # create a HTTPS connection object from a host descriptor
         # host may be a string, or a (host, x509-dict) tuple
-        host, extra_headers, x509 = self.get_host_info(host)
-        conn = http.client.HTTPSConnection(
-            host, None, key_file=self.key_file,
-            cert_file=self.cert_file, context=simple_ssl_context())
+        chost, extra_headers, x509 = self.get_host_info(host)
+        conn = HTTPSConnection(
+            chost, None, key_file=self.key_file,
+            cert_file=self.cert_file, context=self.context,
+            ssl_session=self.ssl_sessions.get(host))
+        self._connection = host, conn
 
         # Some logic to deal with timeouts. It appears that some (or all) versions
         # of python don't set the timeout after the socket is created. We'll do it
@@ -73,6 +106,12 @@ class XMLRPCTransport(xmlrpc.client.Transport):
 
         return conn
 
+    def close(self):
+        host, conn = self._connection
+        xmlrpc.client.Transport.close(self)
+        if conn is not None and conn.ssl_session is not None:
+            self.ssl_sessions[host] = conn.ssl_session
+
     def getparser(self):
         unmarshaller = ExceptionUnmarshaller()
         parser = xmlrpc.client.ExpatParser(unmarshaller)
@@ -1,5 +1,6 @@
 import sys
 import socket
+import threading
 from urllib.parse import urlparse
 
 from sfa.util.sfalogging import logger
@@ -19,10 +20,20 @@ class DummyShell:
                     'UpdateNode', 'UpdateSlice', 'UpdateUser',
                     ]
 
+    # the shell is shared across requests, but xmlrpc proxies
+    # are not thread-safe, so each thread gets its own
     def __init__(self, config):
-        url = config.SFA_DUMMY_URL
-        self.proxy = xmlrpc.client.ServerProxy(
-            url, verbose=False, allow_none=True)
+        self.url = config.SFA_DUMMY_URL
+        self.local = threading.local()
+
+    @property
+    def proxy(self):
+        proxy = getattr(self.local, 'proxy', None)
+        if proxy is None:
+            proxy = xmlrpc.client.ServerProxy(
+                self.url, verbose=False, allow_none=True)
+            self.local.proxy = proxy
+        return proxy
 
     def __getattr__(self, name):
         def func(*args, **kwds):
@@ -102,7 +102,8 @@ class DummySlices:
         resulting_nodes = self.driver.shell.GetNodes(
             {'node_ids': slices[0]['node_ids']})
 
-        # update sliver allocations
+        # update sliver allocations, all at once
+        sliver_allocations = []
         for node in resulting_nodes:
             client_id = slivers[node['hostname']]['client_id']
             component_id = slivers[node['hostname']]['component_id']
@@ -113,7 +114,9 @@ class DummySlices:
                                       component_id=component_id,
                                       slice_urn=slice_urn,
                                       allocation_state='geni_allocated')
-            record.sync(self.driver.api.dbsession())
+            sliver_allocations.append(record)
+        SliverAllocation.sync_allocations(sliver_allocations,
+                                          self.driver.api.dbsession())
         return resulting_nodes
 
     def verify_slice(self, slice_hrn, slice_record, expiration, options=None):
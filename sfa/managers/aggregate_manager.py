@@ -1,18 +1,167 @@
 # pylint: disable=c0111, c0103, r0201
 
+import time
+import threading
+
 from sfa.rspecs.version_manager import VersionManager
 from sfa.util.version import version_core
 from sfa.util.xrn import Xrn
 from sfa.util.callids import Callids
 from sfa.util.sfalogging import logger
+from sfa.util.cache import DEFAULT_CACHE_TTL
 from sfa.util.faults import SfaInvalidArgument, InvalidRSpecVersion
 from sfa.server.api_versions import ApiVersions
 
 
+class AdvertisementRefresher(threading.Thread):
+    """
+    Rebuilds the cached advertisements in the background before they
+    expire, so that ListResources keeps finding them in the cache
+
+    Each (rspec version, options) combination that ListResources gets
+    asked for is tracked, and refreshed as long as clients keep asking
+    for it; a new advertisement simply replaces the previous one in
+    the cache, so clients get either one or the other.
+
+    When the cache is shared by several processes - the prefork workers,
+    or servers using the same memcached - each of them runs a refresher.
+    Whoever builds an advertisement records the time in the cache next
+    to it, and the other refreshers skip their rebuild when they see it.
+    """
+
+    # rebuild when that fraction of the lifetime has elapsed
+    refresh_ratio = 0.8
+    # stop refreshing combinations nobody asked for in that long
+    idle_limit = 24 * 60 * 60
+    # when a rebuild fails, try again after that long
+    retry_delay = 60
+
+    def __init__(self, api, ttl):
+        threading.Thread.__init__(self, name='advertisement-refresher')
+        self.daemon = True
+        self.api = api
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # version_string -> dict with rspec_version, options,
+        # refresh_at and last_used
+        self.tracked = {}
+        self.wakeup = threading.Event()
+
+    def track(self, version_string, rspec_version, options, stored):
+        """
+        called by ListResources; stored tells whether it has just
+        stored a new advertisement in the cache
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.tracked.get(version_string)
+            if entry is None:
+                entry = {'rspec_version': rspec_version,
+                         'options': {key: value
+                                     for key, value in options.items()
+                                     if key not in ('call_id', 'cached')},
+                         'refresh_at': now}
+                self.tracked[version_string] = entry
+            entry['last_used'] = now
+            if stored:
+                entry['refresh_at'] = now + self.ttl * self.refresh_ratio
+        if stored:
+            self.mark_built(version_string, now)
+        self.wakeup.set()
+
+    @staticmethod
+    def built_key(version_string):
+        return version_string + "#built"
+
+    def mark_built(self, version_string, when):
+        self.api.driver.cache.add(self.built_key(version_string), when,
+                                  ttl=self.ttl)
+
+    def built_elsewhere(self, version_string):
+        """
+        returns when the advertisement was last built, if that is recent
+        enough for this refresher to skip its rebuild, and None otherwise
+        """
+        built = self.api.driver.cache.get(self.built_key(version_string))
+        if built is None or \
+                time.time() - built >= self.ttl * self.refresh_ratio:
+            return None
+        return built
+
+    def run(self):
+        while True:
+            now = time.time()
+            due = []
+            with self.lock:
+                for version_string, entry in list(self.tracked.items()):
+                    if now - entry['last_used'] > self.idle_limit:
+                        del self.tracked[version_string]
+                    elif entry['refresh_at'] <= now:
+                        due.append((version_string, entry))
+            for version_string, entry in due:
+                self.refresh(version_string, entry)
+            with self.lock:
+                next_refresh = min([entry['refresh_at']
+                                    for entry in self.tracked.values()],
+                                   default=now + self.retry_delay)
+            self.wakeup.clear()
+            self.wakeup.wait(max(next_refresh - time.time(), 1))
+
+    def refresh(self, version_string, entry):
+        built = self.built_elsewhere(version_string)
+        if built is not None:
+            logger.debug("AdvertisementRefresher: {} was rebuilt by another "
+                         "process".format(version_string))
+            with self.lock:
+                entry['refresh_at'] = built + self.ttl * self.refresh_ratio
+            return
+        # claim the rebuild, so that the other processes skip it; there
+        # still is a small window where two of them can do it at once
+        self.mark_built(version_string, time.time())
+        api = self.api.for_request() \
+            if hasattr(self.api, 'for_request') else self.api
+        try:
+            logger.debug("AdvertisementRefresher: rebuilding {}"
+                         .format(version_string))
+            rspec = api.driver.list_resources(entry['rspec_version'],
+                                              dict(entry['options']))
+            api.driver.cache.add(version_string, rspec, ttl=self.ttl)
+            self.mark_built(version_string, time.time())
+            refresh_at = time.time() + self.ttl * self.refresh_ratio
+        except Exception:
+            logger.log_exc("AdvertisementRefresher: could not rebuild {}"
+                           .format(version_string))
+            # let another process try
+            self.api.driver.cache.pop(self.built_key(version_string))
+            refresh_at = time.time() + self.retry_delay
+        finally:
+            if hasattr(api, 'close_dbsession'):
+                api.close_dbsession()
+        with self.lock:
+            entry['refresh_at'] = refresh_at
+
+
 class AggregateManager:
 
     def __init__(self, config):
-        pass
+        # created with the first ListResources that uses the cache
+        self.refresher = None
+        self.refresher_lock = threading.Lock()
+
+    def get_refresher(self, api):
+        if not getattr(api.config, 'SFA_AGGREGATE_CACHE_REFRESH', True):
+            return None
+        if self.refresher is None:
+            with self.refresher_lock:
+                if self.refresher is None:
+                    self.refresher = AdvertisementRefresher(
+                        api, self.advertisement_ttl(api))
+                    self.refresher.start()
+        return self.refresher
+
+    def advertisement_ttl(self, api):
+        return int(getattr(api.config, 'SFA_AGGREGATE_CACHE_TTL',
+                           DEFAULT_CACHE_TTL))
 
     # essentially a union of the core version, the generic version (this code) and
     # whatever the driver needs to expose
@@ -104,20 +253,30 @@ class AggregateManager:
             options.get('geni_rspec_version'))
         version_string = self.get_rspec_version_string(rspec_version, options)
 
+        refresher = self.get_refresher(api) \
+            if api.driver.cache is not None else None
+
         # look in cache first
         cached_requested = options.get('cached', True)
-        if cached_requested and api.driver.cache:
+        if cached_requested and api.driver.cache is not None:
             rspec = api.driver.cache.get(version_string)
             if rspec:
                 logger.debug("%s.ListResources returning cached advertisement" % (
                     api.driver.__module__))
+                if refresher:
+                    refresher.track(version_string, rspec_version,
+                                    options, stored=False)
                 return rspec
 
         rspec = api.driver.list_resources(rspec_version, options)
-        if api.driver.cache:
+        if api.driver.cache is not None:
             logger.debug("%s.ListResources stores advertisement in cache" % (
                 api.driver.__module__))
-            api.driver.cache.add(version_string, rspec)
+            api.driver.cache.add(version_string, rspec,
+                                 ttl=self.advertisement_ttl(api))
+            if refresher:
+                refresher.track(version_string, rspec_version,
+                                options, stored=True)
         return rspec
 
     def Describe(self, api, creds, urns, options):
@@ -3,6 +3,8 @@
 # and implement reasonable defaults
 #
 
+import copy
+
 
 class Driver:
 
@@ -11,6 +13,15 @@ class Driver:
         # this is the hrn attached to the running server
         self.hrn = api.config.SFA_INTERFACE_HRN
 
+    # the server builds one driver per process, and then each incoming
+    # request uses a copy of it attached to its own api object
+    # so anything set in the constructor (e.g. the connection to the
+    # testbed) is shared by all the requests, and must be thread-safe
+    def for_api(self, api):
+        driver = copy.copy(self)
+        driver.api = api
+        return driver
+
     ########################################
     # registry oriented
     ########################################
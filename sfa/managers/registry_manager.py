@@ -5,6 +5,7 @@
 # for get_key_from_incoming_ip
 import tempfile
 import os
+import time
 import subprocess
 
 from sfa.util.faults import (
@@ -17,6 +18,7 @@ from sfa.util.version import version_core
 from sfa.util.sfalogging import logger
 
 from sfa.util.printable import printable
+from sfa.util.cache import LRUCache
 
 from sfa.trust.gid import GID
 from sfa.trust.credential import Credential
@@ -25,7 +27,7 @@ from sfa.trust.gid import create_uuid
 
 from sfa.storage.model import (
     make_record, RegRecord, RegAuthority, RegUser, RegSlice, RegKey,
-    augment_with_sfa_builtins)
+    augment_with_sfa_builtins, augmented_records_query)
 # the types that we need to exclude from sqlobjects before being able to dump
 # them on the xmlrpc wire
 from sqlalchemy.orm.collections import InstrumentedList
@@ -80,8 +82,34 @@ def normalize_input_record(record):
 
 class RegistryManager:
 
+    # credentials issued by GetCredential, see issued_credential_key
+    issued_credentials = LRUCache(name='issued_credentials')
+
     def __init__(self, config):
         logger.debug("Creating RegistryManager[{}]".format(id(self)))
+        self.reuse_credentials = getattr(
+            config, 'SFA_REGISTRY_CREDENTIAL_CACHE', True)
+        # an issued credential is handed out again only while it
+        # has at least that much of its lifetime left
+        self.credential_min_lifetime = int(getattr(
+            config, 'SFA_REGISTRY_CREDENTIAL_CACHE_MIN_LIFETIME', 50)) / 100.
+
+    def issued_credential_key(self, caller_hrn, caller_record, record,
+                              rights, auth_hrn):
+        """
+        Everything a credential issued by GetCredential depends upon;
+        rights are computed again for each call, so changes in e.g.
+        the PIs of an authority are taken into account
+
+        The cache is per process; what makes an entry stale in all the
+        workers is last_updated, that Update bumps in the database,
+        while removed records are not found anymore in the first place
+        """
+        return (caller_hrn,
+                caller_record.last_updated if caller_record else None,
+                record.hrn, record.type,
+                record.last_updated, getattr(record, 'expires', None),
+                rights.save_to_string(), auth_hrn)
 
     # The GENI GetVersion call
     def GetVersion(self, api, options):
@@ -129,6 +157,7 @@ class RegistryManager:
         if not caller_xrn:
             caller_hrn = hrn
             caller_gid = record.get_gid_object()
+            caller_record = None
         else:
             caller_hrn, caller_type = urn_to_hrn(caller_xrn)
             if caller_type:
@@ -142,16 +171,33 @@ class RegistryManager:
                     "Unable to associated caller (hrn={}, type={}) "
                     "with credential for (hrn: {}, type: {})"
                     .format(caller_hrn, caller_type, hrn, type))
-            caller_gid = GID(string=caller_record.gid)
+            caller_gid = caller_record.get_gid_object()
 
-        object_hrn = record.get_gid_object().get_hrn()
+        object_gid = record.get_gid_object()
+        object_hrn = object_gid.get_hrn()
         # call the builtin authorization/credential generation engine
         rights = api.auth.determine_user_rights(caller_hrn, record)
         # make sure caller has rights to this object
         if rights.is_empty():
             raise PermissionError("{} has no rights to {} ({})"
                                   .format(caller_hrn, object_hrn, xrn))
-        object_gid = GID(string=record.gid)
+
+        # portals ask for the same credentials over and over,
+        # and signing is expensive
+        cache_key = None
+        if self.reuse_credentials:
+            cache_key = self.issued_credential_key(
+                caller_hrn, caller_record, record, rights, auth_hrn)
+            issued = RegistryManager.issued_credentials.get(cache_key)
+            if issued:
+                cred_string, issued_at, expires_at = issued
+                now = time.time()
+                if expires_at - now >= \
+                        (expires_at - issued_at) * self.credential_min_lifetime:
+                    logger.debug("GetCredential: reusing credential for {} "
+                                 "on {}".format(caller_hrn, object_hrn))
+                    return cred_string
+
         new_cred = Credential(subject=object_gid.get_subject())
         new_cred.set_gid_caller(caller_gid)
         new_cred.set_gid_object(object_gid)
@@ -170,7 +216,13 @@ class RegistryManager:
         new_cred.encode()
         new_cred.sign()
 
-        return new_cred.save_to_string(save_parents=True)
+        cred_string = new_cred.save_to_string(save_parents=True)
+        if cache_key:
+            expires_at = datetime_to_epoch(new_cred.get_expiration())
+            RegistryManager.issued_credentials.add(
+                cache_key, (cred_string, time.time(), expires_at),
+                expires=expires_at)
+        return cred_string
 
     # the default for full, which means 'dig into the testbed as well', should
     # be false
@@ -228,7 +280,7 @@ class RegistryManager:
         local_hrns = list(set(hrns).difference(
             [record['hrn'] for record in records]))
         #
-        local_records = dbsession.query(RegRecord).filter(
+        local_records = augmented_records_query(dbsession).filter(
             RegRecord.hrn.in_(local_hrns))
         if type:
             local_records = local_records.filter_by(type=type)
@@ -313,13 +365,13 @@ class RegistryManager:
             if not api.auth.hierarchy.auth_exists(hrn):
                 raise MissingAuthority(hrn)
             if recursive:
-                records = dbsession.query(RegRecord).filter(
+                records = augmented_records_query(dbsession).filter(
                     RegRecord.hrn.startswith(hrn)).all()
                     # logger.debug("recursive mode, found {} local records".
                     #              format(len(records)))
             else:
-                records = dbsession.query(
-                    RegRecord).filter_by(authority=hrn).all()
+                records = augmented_records_query(dbsession)\
+                    .filter_by(authority=hrn).all()
                     # logger.debug("non recursive mode, found {} local records"
                     #              .format(len(records)))
             # so that sfi list can show more than plain names...
@@ -1,4 +1,5 @@
 import zlib
+import base64
 
 from sfa.util.xrn import urn_to_hrn
 from sfa.util.method import Method
@@ -62,7 +63,7 @@ class Describe(Method):
             chain_name, '', origin_hrn, desc['geni_rspec'])
 
         if 'geni_compressed' in options and options['geni_compressed'] == True:
-            desc['geni_rspec'] = zlib.compress(
-                desc['geni_rspec']).encode('base64')
+            desc['geni_rspec'] = base64.b64encode(
+                zlib.compress(desc['geni_rspec'].encode())).decode()
 
         return desc
@@ -1,4 +1,5 @@
 import zlib
+import base64
 
 from sfa.util.xrn import urn_to_hrn
 from sfa.util.method import Method
@@ -57,6 +58,7 @@ class ListResources(Method):
         filtered_rspec = run_sfatables(chain_name, '', origin_hrn, rspec)
 
         if 'geni_compressed' in options and options['geni_compressed'] == True:
-            filtered_rspec = zlib.compress(filtered_rspec).encode('base64')
+            filtered_rspec = base64.b64encode(
+                zlib.compress(filtered_rspec.encode())).decode()
 
         return filtered_rspec
@@ -3,6 +3,7 @@ from collections import defaultdict
 from sfa.util.xrn import Xrn, hrn_to_urn, urn_to_hrn, get_authority, get_leaf
 from sfa.util.sfatime import utcparse, datetime_to_string
 from sfa.util.sfalogging import logger
+from sfa.util.cache import LRUCache
 from sfa.util.faults import SliverDoesNotExist
 from sfa.rspecs.rspec import RSpec
 from sfa.rspecs.elements.hardware_type import HardwareType
@@ -24,11 +25,25 @@ from sfa.planetlab.topology import Topology
 from sfa.storage.model import SliverAllocation
 
 
+import io
+import json
 import time
+import hashlib
 
 
 class PlAggregate:
 
+    # links computed from the topology file, see get_links
+    links_cache = LRUCache(max_size=20, name='links')
+    # serialized rspec nodes, see node_fragments
+    fragments_cache = LRUCache(max_size=50000, name='rspec_fragments')
+
+    # the node and site fields that node_to_rspec_node depends on
+    fragment_node_fields = ('node_id', 'site_id', 'hostname', 'boot_state',
+                            'node_type', 'interface_ids', 'node_tag_ids')
+    fragment_site_fields = ('site_id', 'login_base',
+                            'longitude', 'latitude')
+
     def __init__(self, driver):
         self.driver = driver
 
@@ -64,51 +79,82 @@ class PlAggregate:
 
     def get_links(self, sites, nodes, interfaces):
 
-        topology = Topology()
+        topology = Topology.load()
+        # the same sites, nodes and interfaces come up again and again,
+        # e.g. for each ListResources when the advertisement is not cached
+        signature = self.links_signature(topology, sites, nodes, interfaces)
+        links = PlAggregate.links_cache.get(signature)
+        if links is None:
+            links = self.compute_links(topology, sites, nodes, interfaces)
+            PlAggregate.links_cache.add(signature, links)
+        return list(links)
+
+    def links_signature(self, topology, sites, nodes, interfaces):
+        """
+        what the links depend on, besides the topology file
+        """
+        linked_site_ids = set()
+        for (site_id1, site_id2) in topology:
+            linked_site_ids.add(int(site_id1))
+            linked_site_ids.add(int(site_id2))
+        signature = []
+        for site_id in sorted(linked_site_ids & set(sites)):
+            site = sites[site_id]
+            for node_id in site['node_ids']:
+                if node_id not in nodes:
+                    continue
+                interface_ids = nodes[node_id]['interface_ids']
+                ip = interfaces[interface_ids[0]]['ip'] \
+                    if interface_ids else None
+                signature.append((site_id, site['login_base'], node_id, ip))
+        return (self.driver.hrn, topology.config_file, topology.mtime,
+                tuple(signature))
+
+    def compute_links(self, topology, sites, nodes, interfaces):
+        component_manager_id = hrn_to_urn(self.driver.hrn, 'authority+am')
+        # the interface of a node in a link - its first one - only depends
+        # on the node, not on the link
+        endpoints = {}
+
+        def endpoint(node):
+            if node['node_id'] not in endpoints:
+                if_xrn = PlXrn(auth=self.driver.hrn,
+                               interface='node%s:eth0' % (node['node_id']))
+                if_ipv4 = interfaces[node['interface_ids'][0]]['ip']
+                endpoints[node['node_id']] = Interface(
+                    {'component_id': if_xrn.urn, 'ipv4': if_ipv4})
+            return endpoints[node['node_id']]
+
         links = []
         for (site_id1, site_id2) in topology:
             site_id1 = int(site_id1)
             site_id2 = int(site_id2)
-            link = Link()
             if not site_id1 in sites or site_id2 not in sites:
                 continue
             site1 = sites[site_id1]
             site2 = sites[site_id2]
-            # get hrns
-            site1_hrn = self.driver.hrn + '.' + site1['login_base']
-            site2_hrn = self.driver.hrn + '.' + site2['login_base']
-
-            for s1_node_id in site1['node_ids']:
-                for s2_node_id in site2['node_ids']:
-                    if s1_node_id not in nodes or s2_node_id not in nodes:
-                        continue
-                    node1 = nodes[s1_node_id]
-                    node2 = nodes[s2_node_id]
-                    # set interfaces
-                    # just get first interface of the first node
-                    if1_xrn = PlXrn(auth=self.driver.hrn,
-                                    interface='node%s:eth0' % (node1['node_id']))
-                    if1_ipv4 = interfaces[node1['interface_ids'][0]]['ip']
-                    if2_xrn = PlXrn(auth=self.driver.hrn,
-                                    interface='node%s:eth0' % (node2['node_id']))
-                    if2_ipv4 = interfaces[node2['interface_ids'][0]]['ip']
-
-                    if1 = Interface(
-                        {'component_id': if1_xrn.urn, 'ipv4': if1_ipv4})
-                    if2 = Interface(
-                        {'component_id': if2_xrn.urn, 'ipv4': if2_ipv4})
-
+            site1_nodes = [nodes[node_id] for node_id in site1['node_ids']
+                           if node_id in nodes]
+            site2_nodes = [nodes[node_id] for node_id in site2['node_ids']
+                           if node_id in nodes]
+            if not site1_nodes or not site2_nodes:
+                continue
+            component_name = "%s:%s" % (
+                site1['login_base'], site2['login_base'])
+            component_id = PlXrn(auth=self.driver.hrn,
+                                 interface=component_name).get_urn()
+
+            for node1 in site1_nodes:
+                if1 = endpoint(node1)
+                for node2 in site2_nodes:
                     # set link
                     link = Link({'capacity': '1000000', 'latency': '0',
                                  'packet_loss': '0', 'type': 'ipv4'})
                     link['interface1'] = if1
-                    link['interface2'] = if2
-                    link['component_name'] = "%s:%s" % (
-                        site1['login_base'], site2['login_base'])
-                    link['component_id'] = PlXrn(auth=self.driver.hrn, interface=link[
-                                                 'component_name']).get_urn()
-                    link['component_manager_id'] = hrn_to_urn(
-                        self.driver.hrn, 'authority+am')
+                    link['interface2'] = endpoint(node2)
+                    link['component_name'] = component_name
+                    link['component_id'] = component_id
+                    link['component_manager_id'] = component_manager_id
                     links.append(link)
 
         return links
@@ -121,6 +167,58 @@ class PlAggregate:
             node_tags[node_tag['node_tag_id']] = node_tag
         return node_tags
 
+    def get_hardware_types(self, node_ids):
+        """
+        node_id -> value of the hardware_type tag, for the nodes that have one
+
+        one single call for all the nodes, rather than one per node
+        """
+        hardware_types = {}
+        if not node_ids:
+            return hardware_types
+        tags = self.driver.shell.GetNodeTags(
+            {'node_id': list(node_ids), 'tagname': 'hardware_type'},
+            ['node_id', 'value'])
+        for tag in tags:
+            hardware_types.setdefault(tag['node_id'], tag['value'])
+        return hardware_types
+
+    def get_site_location_tags(self, site_ids):
+        """
+        site_id -> {tagname: value} for the country and city site tags
+        """
+        site_tags = defaultdict(dict)
+        if not site_ids:
+            return site_tags
+        tags = self.driver.shell.GetSiteTags(
+            {'site_id': list(site_ids), 'tagname': ['country', 'city']},
+            ['site_id', 'tagname', 'value'])
+        for tag in tags:
+            site_tags[tag['site_id']].setdefault(tag['tagname'], tag['value'])
+        return site_tags
+
+    def get_node_hrns(self, hostnames):
+        """
+        hostname -> hrn, in a single GetNodes call
+        """
+        if not hostnames:
+            return {}
+        # as with GetNodeHrn, hrn is the node tag of that name
+        nodes = self.driver.shell.GetNodes(
+            {'hostname': list(hostnames)}, ['hostname', 'hrn'])
+        return {node['hostname']: node['hrn'] for node in nodes if node['hrn']}
+
+    def get_slice_hrns(self, slice_ids):
+        """
+        slice_id -> hrn, in a single GetSlices call
+        """
+        if not slice_ids:
+            return {}
+        slices = self.driver.shell.GetSlices(
+            {'slice_id': list(slice_ids)}, ['slice_id', 'hrn'])
+        return {slice['slice_id']: slice['hrn'] for slice in slices
+                if slice['hrn']}
+
     def get_pl_initscripts(self, filter=None):
         if filter is None:
             filter = {}
@@ -236,11 +334,21 @@ class PlAggregate:
                 "PlAggregate.get_slivers : slice(s) found but with no sliver {}".format(urns))
         return slivers
 
-    def node_to_rspec_node(self, node, sites, interfaces, node_tags, pl_initscripts=None, grain=None, options=None):
+    def node_to_rspec_node(self, node, sites, interfaces, node_tags, pl_initscripts=None, grain=None, options=None,
+                           hardware_types=None, site_tags=None):
+        """
+        hardware_types and site_tags are as returned by get_hardware_types
+        and get_site_location_tags; callers that deal with many nodes should
+        fetch them once for all nodes, otherwise they are fetched here
+        """
         if pl_initscripts is None:
             pl_initscripts = []
         if options is None:
             options = {}
+        if hardware_types is None:
+            hardware_types = self.get_hardware_types([node['node_id']])
+        if site_tags is None:
+            site_tags = self.get_site_location_tags([node['site_id']])
         rspec_node = NodeElement()
         # xxx how to retrieve site['login_base']
         site = sites[node['site_id']]
@@ -266,13 +374,9 @@ class PlAggregate:
 
         # expose hardware_types from the hardware_type tag if
         # set on node
-        tags = self.driver.shell.GetNodeTags({
-            'node_id': node['node_id'],
-            'tagname': 'hardware_type',
-        })
-        if tags:
+        if node['node_id'] in hardware_types:
             rspec_node['hardware_types'] = [
-                HardwareType({'name': tags[0]['value']}),
+                HardwareType({'name': hardware_types[node['node_id']]}),
             ]
         else:
             rspec_node['hardware_types'] = [
@@ -289,16 +393,9 @@ class PlAggregate:
                 'longitude': site['longitude'],
                 'latitude': site['latitude'],
             }
+            location_tags = site_tags.get(site['site_id'], {})
             for extra in ('country', 'city'):
-                try:
-                    tags = self.driver.shell.GetSiteTags({
-                        'site_id' : site['site_id'],
-                        'tagname' : extra,
-                    })
-                    location_dict[extra] = tags[0]['value']
-                except:
-                    logger.log_exc('extra = {}'.format(extra))
-                    location_dict[extra] = 'unknown'
+                location_dict[extra] = location_tags.get(extra, 'unknown')
             location = Location(location_dict)
             rspec_node['location'] = location
         # Granularity
@@ -323,11 +420,13 @@ class PlAggregate:
         return rspec_node
 
     def sliver_to_rspec_node(self, sliver, sites, interfaces, node_tags, sliver_pltags,
-                             pl_initscripts, sliver_allocations):
+                             pl_initscripts, sliver_allocations,
+                             hardware_types=None, site_tags=None):
         # get the granularity in second for the reservation system
-        grain = self.driver.shell.GetLeaseGranularity()
+        grain = self.driver.get_lease_granularity()
         rspec_node = self.node_to_rspec_node(
-            sliver, sites, interfaces, node_tags, pl_initscripts, grain)
+            sliver, sites, interfaces, node_tags, pl_initscripts, grain,
+            hardware_types=hardware_types, site_tags=site_tags)
         for pltag in sliver_pltags:
             logger.debug("Need to expose {}".format(pltag))
         # xxx how to retrieve site['login_base']
@@ -361,6 +460,65 @@ class PlAggregate:
         rspec_node['services'] = [service]
         return rspec_node
 
+    def node_fragments(self, rspec, nodes, sites, interfaces, node_tags,
+                       pl_initscripts, grain, hardware_types, site_tags,
+                       pretty_print):
+        """
+        the serialized rspec nodes for an advertisement, as RSpecFragment
+        objects in the order of nodes
+
+        most nodes are the same from one call to the next, so the
+        fragments are kept in fragments_cache together with a digest of
+        what they were made from; only the nodes whose digest has changed
+        go through node_to_rspec_node again
+        """
+        version = type(rspec.version).__name__
+        shared = self.fragment_digest(
+            [pl_initscripts[key] for key in sorted(pl_initscripts)], grain)
+        fragments = []
+        stale = []
+        for node in nodes:
+            site = sites[node['site_id']]
+            digest = self.fragment_digest(
+                shared,
+                [node[field] for field in self.fragment_node_fields],
+                [site[field] for field in self.fragment_site_fields],
+                [interfaces[if_id] for if_id in node['interface_ids']],
+                [node_tags.get(tag_id) for tag_id in node['node_tag_ids']],
+                hardware_types.get(node['node_id']),
+                site_tags.get(node['site_id']))
+            key = (version, pretty_print, node['node_id'])
+            cached = PlAggregate.fragments_cache.get(key)
+            if cached and cached[0] == digest:
+                fragments.append(cached[1])
+            else:
+                fragments.append(None)
+                stale.append((len(fragments) - 1, key, digest, node))
+        if stale:
+            rspec_nodes = (
+                self.node_to_rspec_node(
+                    node, sites, interfaces, node_tags, pl_initscripts, grain,
+                    hardware_types=hardware_types, site_tags=site_tags)
+                for (_, _, _, node) in stale)
+            rendered = list(rspec.render(nodes=rspec_nodes,
+                                         pretty_print=pretty_print))
+            if len(rendered) != len(stale):
+                # cannot tell which fragment goes with which node
+                logger.warning("PlAggregate: got {} fragments for {} nodes, "
+                               "not caching them"
+                               .format(len(rendered), len(stale)))
+                fragments = [fragment for fragment in fragments if fragment]
+                return fragments + rendered
+            for (index, key, digest, _), fragment in zip(stale, rendered):
+                fragments[index] = fragment
+                PlAggregate.fragments_cache.add(key, (digest, fragment))
+        return fragments
+
+    @staticmethod
+    def fragment_digest(*inputs):
+        data = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
+
     def get_pltags_by_node_id(self, slice):
         slice_tag_ids = []
         slice_tag_ids.extend(slice['slice_tag_ids'])
@@ -449,27 +607,29 @@ class PlAggregate:
         return_fields = ['lease_id', 'hostname',
                          'site_id', 'name', 't_from', 't_until']
         leases = self.driver.shell.GetLeases(filter)
-        grain = self.driver.shell.GetLeaseGranularity()
-
-        site_ids = []
-        for lease in leases:
-            site_ids.append(lease['site_id'])
+        grain = self.driver.get_lease_granularity()
 
-        # get sites
-        sites_dict = self.get_sites({'site_id': site_ids})
+        # resolve all node and slice hrns at once rather than
+        # with one GetNodeHrn and one GetSliceHrn call per lease
+        node_hrns = self.get_node_hrns(
+            set(lease['hostname'] for lease in leases))
+        slice_hrns = self.get_slice_hrns(
+            set(lease['slice_id'] for lease in leases))
 
         rspec_leases = []
         for lease in leases:
 
             rspec_lease = Lease()
 
-            # xxx how to retrieve site['login_base']
-            site_id = lease['site_id']
-            site = sites_dict[site_id]
-
-            rspec_lease['component_id'] = hrn_to_urn(
-                self.driver.shell.GetNodeHrn(lease['hostname']), 'node')
-            slice_hrn = self.driver.shell.GetSliceHrn(lease['slice_id'])
+            node_hrn = node_hrns.get(lease['hostname'])
+            if node_hrn is None:
+                node_hrn = self.driver.shell.GetNodeHrn(lease['hostname'])
+                node_hrns[lease['hostname']] = node_hrn
+            rspec_lease['component_id'] = hrn_to_urn(node_hrn, 'node')
+            slice_hrn = slice_hrns.get(lease['slice_id'])
+            if slice_hrn is None:
+                slice_hrn = self.driver.shell.GetSliceHrn(lease['slice_id'])
+                slice_hrns[lease['slice_id']] = slice_hrn
             slice_urn = hrn_to_urn(slice_hrn, 'slice')
             rspec_lease['slice_id'] = slice_urn
             rspec_lease['start_time'] = lease['t_from']
@@ -487,6 +647,8 @@ class PlAggregate:
         rspec_version = version_manager._get_version(
             version.type, version.version, 'ad')
         rspec = RSpec(version=rspec_version, user_options=options)
+        pretty_print = getattr(self.driver.api.config,
+                               'SFA_AGGREGATE_PRETTY_PRINT', True)
 
         if not options.get('list_leases') or options['list_leases'] != 'leases':
             # get nodes
@@ -503,25 +665,29 @@ class PlAggregate:
             sites = self.get_sites({'site_id': site_ids})
             interfaces = self.get_interfaces({'interface_id': interface_ids})
             node_tags = self.get_node_tags({'node_tag_id': tag_ids})
+            hardware_types = self.get_hardware_types(list(nodes_dict.keys()))
+            site_tags = self.get_site_location_tags(list(sites.keys()))
             pl_initscripts = self.get_pl_initscripts()
-            # convert nodes to rspec nodes
-            grain = self.driver.shell.GetLeaseGranularity()
-            rspec_nodes = []
-            for node in nodes:
-                rspec_node = self.node_to_rspec_node(
-                    node, sites, interfaces, node_tags, pl_initscripts, grain)
-                rspec_nodes.append(rspec_node)
-            rspec.version.add_nodes(rspec_nodes)
+            grain = self.driver.get_lease_granularity()
+            rspec_nodes = self.node_fragments(
+                rspec, nodes, sites, interfaces, node_tags, pl_initscripts,
+                grain, hardware_types, site_tags, pretty_print)
 
             # add links
             links = self.get_links(sites, nodes_dict, interfaces)
-            rspec.version.add_links(links)
+        else:
+            rspec_nodes = links = None
 
         if not options.get('list_leases') or options.get('list_leases') and options['list_leases'] != 'resources':
             leases = self.get_leases()
-            rspec.version.add_leases(leases)
+        else:
+            leases = None
 
-        return rspec.toxml()
+        # the advertisement can be huge, so don't build it as a whole
+        out = io.StringIO()
+        rspec.write(out, nodes=rspec_nodes, links=links, leases=leases,
+                    pretty_print=pretty_print)
+        return out.getvalue()
 
     def describe(self, urns, version=None, options=None):
         if options is None:
@@ -567,6 +733,8 @@ class PlAggregate:
             sites = self.get_sites({'site_id': site_ids})
             interfaces = self.get_interfaces({'interface_id': interface_ids})
             node_tags = self.get_node_tags({'node_tag_id': tag_ids})
+            hardware_types = self.get_hardware_types(list(nodes_dict.keys()))
+            site_tags = self.get_site_location_tags(list(sites.keys()))
             pl_initscripts = self.get_pl_initscripts()
             rspec_nodes = []
             for sliver in slivers:
@@ -574,7 +742,8 @@ class PlAggregate:
                     continue
                 sliver_pltags = sliver['slice-tags']
                 rspec_node = self.sliver_to_rspec_node(sliver, sites, interfaces, node_tags, sliver_pltags,
-                                                       pl_initscripts, sliver_allocation_dict)
+                                                       pl_initscripts, sliver_allocation_dict,
+                                                       hardware_types=hardware_types, site_tags=site_tags)
                 logger.debug('rspec of type {}'.format(
                     rspec_node.__class__.__name__))
                 # manifest node element shouldn't contain available attribute
@@ -1,3 +1,4 @@
+import os
 import datetime
 #
 from sfa.util.faults import MissingSfaInfo, UnknownSfaType, \
@@ -7,7 +8,7 @@ from sfa.util.sfalogging import logger
 from sfa.util.defaultdict import defaultdict
 from sfa.util.sfatime import utcparse, datetime_to_string, datetime_to_epoch
 from sfa.util.xrn import Xrn, hrn_to_urn, get_leaf
-from sfa.util.cache import Cache
+from sfa.util.cache import make_cache, LRUCache
 
 # one would think the driver should not need to mess with the SFA db, but..
 from sfa.storage.model import RegRecord, SliverAllocation
@@ -20,7 +21,7 @@ from sfa.rspecs.rspec import RSpec
 
 # the driver interface, mostly provides default behaviours
 from sfa.managers.driver import Driver
-from sfa.planetlab.plshell import PlShell
+from sfa.planetlab.plshell import PlShell, PlTablesCache
 from sfa.planetlab.plaggregate import PlAggregate
 from sfa.planetlab.plslices import PlSlices
 from sfa.planetlab.plxrn import PlXrn, slicename_to_hrn, hostname_to_hrn, hrn_to_pl_slicename, top_auth, hash_loginbase
@@ -46,16 +47,42 @@ class PlDriver (Driver):
     # requests
     cache = None
 
+    # same for the cache of the PLC sites, nodes, interfaces... tables
+    tables_cache = None
+
+    # the lease granularity is a myplc setting that hardly ever changes,
+    # no need to ask for it every time leases are listed or checked
+    lease_granularity_cache = LRUCache(max_size=1, ttl=10 * 60,
+                                       name='lease_granularity')
+
     def __init__(self, api):
         Driver.__init__(self, api)
         config = api.config
-        self.shell = PlShell(config)
+        if getattr(config, 'SFA_PLC_CACHING', True):
+            if PlDriver.tables_cache is None:
+                PlDriver.tables_cache = PlTablesCache()
+            self.shell = PlShell(config, tables_cache=PlDriver.tables_cache)
+        else:
+            self.shell = PlShell(config)
         self.cache = None
         if config.SFA_AGGREGATE_CACHING:
             if PlDriver.cache is None:
-                PlDriver.cache = Cache()
+                PlDriver.cache = make_cache(
+                    getattr(config, 'SFA_AGGREGATE_CACHE_BACKEND', 'memory'),
+                    name='advertisement',
+                    dirname=os.path.join(
+                        config.SFA_DATA_DIR, 'cache', 'aggregate'),
+                    server=getattr(config, 'SFA_AGGREGATE_CACHE_SERVER',
+                                   None))
             self.cache = PlDriver.cache
 
+    def get_lease_granularity(self):
+        grain = PlDriver.lease_granularity_cache.get('grain')
+        if grain is None:
+            grain = self.shell.GetLeaseGranularity()
+            PlDriver.lease_granularity_cache.add('grain', grain)
+        return grain
+
     def sliver_to_slice_xrn(self, xrn):
         sliver_id_parts = Xrn(xrn).get_sliver_id_parts()
         filter = {'peer_id': None}
@@ -168,12 +195,6 @@ class PlDriver (Driver):
             else:
                 pointer = persons[0]['person_id']
 
-            # enable the person's account
-            self.shell.UpdatePerson(pointer, {'enabled': True})
-            # add this person to the site
-            login_base = get_leaf(sfa_record['authority'])
-            self.shell.AddPersonToSite(pointer, login_base)
-
             # What roles should this user have?
             roles = []
             if 'roles' in sfa_record:
@@ -183,12 +204,20 @@ class PlDriver (Driver):
             # at least user if no other cluse could be found
             if not roles:
                 roles = ['user']
-            for role in roles:
-                self.shell.AddRoleToPerson(role, pointer)
-            # Add the user's key
-            if pub_key:
-                self.shell.AddPersonKey(
-                    pointer, {'key_type': 'ssh', 'key': pub_key})
+
+            # enable the person's account
+            self.shell.UpdatePerson(pointer, {'enabled': True})
+            # add this person to the site
+            login_base = get_leaf(sfa_record['authority'])
+            self.shell.AddPersonToSite(pointer, login_base)
+            # the roles and the key do not depend on each other
+            with self.shell.batch() as batch:
+                for role in roles:
+                    batch.AddRoleToPerson(role, pointer)
+                # Add the user's key
+                if pub_key:
+                    batch.AddPersonKey(
+                        pointer, {'key_type': 'ssh', 'key': pub_key})
 
         elif type == 'node':
             login_base = PlXrn(
@@ -641,23 +670,25 @@ class PlDriver (Driver):
                 set(current_target_ids).difference(target_ids))
             logger.debug("subject_id = {} (type={})".format(
                 subject_id, type(subject_id)))
-            for target_id in add_target_ids:
-                self.shell.AddPersonToSlice(target_id, subject_id)
-                logger.debug("add_target_id = {} (type={})".format(
-                    target_id, type(target_id)))
-            for target_id in del_target_ids:
-                logger.debug("del_target_id = {} (type={})".format(
-                    target_id, type(target_id)))
-                self.shell.DeletePersonFromSlice(target_id, subject_id)
+            with self.shell.batch() as batch:
+                for target_id in add_target_ids:
+                    batch.AddPersonToSlice(target_id, subject_id)
+                    logger.debug("add_target_id = {} (type={})".format(
+                        target_id, type(target_id)))
+                for target_id in del_target_ids:
+                    logger.debug("del_target_id = {} (type={})".format(
+                        target_id, type(target_id)))
+                    batch.DeletePersonFromSlice(target_id, subject_id)
         elif subject_type == 'authority' and target_type == 'user' and relation_name == 'pi':
             # due to the plcapi limitations this means essentially adding pi role to all people in the list
             # it's tricky to remove any pi role here, although it might be
             # desirable
             persons = self.shell.GetPersons(
                 {'peer_id': None, 'person_id': target_ids})
-            for person in persons:
-                if 'pi' not in person['roles']:
-                    self.shell.AddRoleToPerson('pi', person['person_id'])
+            with self.shell.batch() as batch:
+                for person in persons:
+                    if 'pi' not in person['roles']:
+                        batch.AddRoleToPerson('pi', person['person_id'])
         else:
             logger.info('unexpected relation {} to maintain, {} -> {}'
                         .format(relation_name, subject_type, target_type))
@@ -1,10 +1,185 @@
 import sys
+import copy
+import queue
 import xmlrpc.client
 import socket
+import threading
 from urllib.parse import urlparse
 
 from sfa.util.sfalogging import logger
 from sfa.util.ssl import simple_ssl_context
+from sfa.util.cache import LRUCache
+
+class PlcTransport(xmlrpc.client.SafeTransport):
+    """
+    A SafeTransport with a socket timeout; like the stock one, it keeps
+    its HTTP(S) connection open between calls as long as the server
+    allows it
+    """
+
+    def __init__(self, scheme, timeout, context=None):
+        xmlrpc.client.SafeTransport.__init__(self, context=context)
+        self.scheme = scheme
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        if self.scheme == 'https':
+            conn = xmlrpc.client.SafeTransport.make_connection(self, host)
+        else:
+            conn = xmlrpc.client.Transport.make_connection(self, host)
+        conn.timeout = self.timeout
+        return conn
+
+
+class PlcConnectionPool:
+    """
+    A process-wide pool of xmlrpc proxies to one PLCAPI url
+
+    xmlrpc proxies are not thread-safe, so each call takes a proxy from
+    the pool and puts it back when done; an idle proxy keeps its
+    connection open so that the next call can skip the TCP and TLS
+    handshakes. At most size calls are in progress at any time, the
+    other ones wait up to timeout seconds for a proxy to become free.
+    """
+
+    # url -> pool
+    pools = {}
+    pools_lock = threading.Lock()
+
+    @staticmethod
+    def get_pool(url, size, timeout):
+        with PlcConnectionPool.pools_lock:
+            pool = PlcConnectionPool.pools.get(url)
+            if pool is None:
+                pool = PlcConnectionPool(url, size, timeout)
+                PlcConnectionPool.pools[url] = pool
+            return pool
+
+    def __init__(self, url, size, timeout):
+        self.url = url
+        self.size = size
+        self.timeout = timeout
+        # the most recently used proxy is the most likely to be connected
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def make_proxy(self):
+        transport = PlcTransport(urlparse(self.url).scheme, self.timeout,
+                                 context=simple_ssl_context())
+        return xmlrpc.client.ServerProxy(
+            self.url, transport=transport, verbose=False, allow_none=True)
+
+    def call(self, method_name, *args, **kwds):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Exception("no connection to PLCAPI available after %s s"
+                            % self.timeout)
+        try:
+            try:
+                proxy = self.idle.get_nowait()
+            except queue.Empty:
+                proxy = self.make_proxy()
+            try:
+                return getattr(proxy, method_name)(*args, **kwds)
+            finally:
+                # the transport drops the connection itself if it is broken
+                self.idle.put(proxy)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                proxy = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            proxy('close')()
+
+
+class PlTablesCache:
+    """
+    A read-through cache for the PLCAPI calls that read slowly-changing
+    tables; the results of each call are kept, per table, for the
+    table's ttl.
+
+    Writes that go through a shell using this cache invalidate the tables
+    they affect, so that our own changes are seen right away; changes
+    made by others - e.g. through the PLC web UI, or another server
+    process - are seen after at most the ttl.
+    """
+
+    # cached call -> table
+    tables = {
+        'GetSites': 'sites',
+        'GetSiteTags': 'sites',
+        'GetNodes': 'nodes',
+        'GetNodeTags': 'nodes',
+        'GetInterfaces': 'interfaces',
+        'GetInitScripts': 'initscripts',
+        'GetTagTypes': 'tagtypes',
+    }
+
+    # in seconds; nodes change the most often, mostly their boot_state
+    default_ttls = {
+        'sites': 5 * 60,
+        'nodes': 60,
+        'interfaces': 5 * 60,
+        'initscripts': 60 * 60,
+        'tagtypes': 60 * 60,
+    }
+
+    # write call -> tables it affects
+    invalidations = {
+        'AddSite': ['sites'],
+        'UpdateSite': ['sites'],
+        'DeleteSite': ['sites', 'nodes', 'interfaces'],
+        'SetSiteHrn': ['sites'],
+        'SetSiteSfaCreated': ['sites'],
+        'AddSiteTag': ['sites'],
+        # sites have person_ids and slice_ids
+        'AddPersonToSite': ['sites'],
+        'DeletePerson': ['sites'],
+        'AddSlice': ['sites'],
+        'DeleteSlice': ['sites', 'nodes'],
+        'AddNode': ['sites', 'nodes'],
+        'UpdateNode': ['nodes'],
+        'DeleteNode': ['sites', 'nodes', 'interfaces'],
+        'SetNodeHrn': ['nodes'],
+        'SetNodeSfaCreated': ['nodes'],
+        # nodes have slice_ids
+        'AddSliceToNodes': ['nodes'],
+        'DeleteSliceFromNodes': ['nodes'],
+        'BindObjectToPeer': ['sites', 'nodes'],
+        'UnBindObjectFromPeer': ['sites', 'nodes'],
+    }
+
+    def __init__(self, ttls=None, max_size=1000):
+        all_ttls = dict(PlTablesCache.default_ttls)
+        all_ttls.update(ttls or {})
+        self.caches = {
+            table: LRUCache(max_size=max_size, ttl=ttl,
+                            name='plc_' + table)
+            for table, ttl in all_ttls.items()}
+
+    def get(self, method_name, args, fetch):
+        """
+        the cached result of method_name(*args), or else what fetch() returns
+        """
+        cache = self.caches[PlTablesCache.tables[method_name]]
+        key = (method_name, repr(args))
+        result = cache.get(key)
+        if result is None:
+            result = fetch()
+            cache.add(key, result)
+        # callers often modify what they get
+        return copy.deepcopy(result)
+
+    def invalidate(self, *tables):
+        for table in tables:
+            self.caches[table].clear()
+
+    def wrote(self, method_name):
+        self.invalidate(*PlTablesCache.invalidations.get(method_name, []))
+
 
 class PlShell:
     """
@@ -42,10 +217,17 @@ class PlShell:
         'get_nodes': 'GetNodes',
     }
 
-    # use the 'capability' auth mechanism for higher performance when the PLC
-    # db is local
-    def __init__(self, config):
-        url = config.SFA_PLC_URL
+    # url -> whether PLCAPI can be used in-process
+    direct_access_by_url = {}
+
+    @staticmethod
+    def detect_direct_access(url):
+        """
+        whether the url is local and the PLC code is installed; this
+        costs a couple of DNS requests, so it's done once per process
+        """
+        if url in PlShell.direct_access_by_url:
+            return PlShell.direct_access_by_url[url]
         # try to figure if the url is local
         hostname = urlparse(url).hostname
         is_local = False
@@ -54,8 +236,6 @@ class PlShell:
         # otherwise compare IP addresses;
         # this might fail for any number of reasons, so let's harden that
         try:
-            # xxx todo this seems to result in a DNS request for each incoming request to the AM
-            # should be cached or improved
             url_ip = socket.gethostbyname(hostname)
             local_ip = socket.gethostbyname(socket.gethostname())
             if url_ip == local_ip:
@@ -63,6 +243,7 @@ class PlShell:
         except:
             pass
 
+        plc_direct_access = False
         if is_local:
             try:
                 # too bad this is not installed properly
@@ -73,15 +254,28 @@ class PlShell:
                 plc_direct_access = True
             except:
                 plc_direct_access = False
-        if is_local and plc_direct_access:
+        direct_access = is_local and plc_direct_access
+        PlShell.direct_access_by_url[url] = direct_access
+        return direct_access
+
+    # use the 'capability' auth mechanism for higher performance when the PLC
+    # db is local
+    # otherwise calls go through a connection pool that is shared by all
+    # the shells of the process, see PlcConnectionPool
+    # a PlTablesCache can be passed to cache the reads of some tables
+    def __init__(self, config, tables_cache=None):
+        url = config.SFA_PLC_URL
+        self.url = url
+        self.tables_cache = tables_cache
+        self.direct_access = PlShell.detect_direct_access(url)
+        self.pool = None
+        if self.direct_access:
             logger.debug('plshell access - capability')
             self.plauth = {
                 'AuthMethod': 'capability',
                 'Username': str(config.SFA_PLC_USER),
                 'AuthString': str(config.SFA_PLC_PASSWORD),
             }
-            self.proxy = PLC.Shell.Shell()
-
         else:
             logger.debug('plshell access - xmlrpc')
             self.plauth = {
@@ -89,22 +283,174 @@ class PlShell:
                 'Username':   str(config.SFA_PLC_USER),
                 'AuthString': str(config.SFA_PLC_PASSWORD),
             }
-            self.proxy = xmlrpc.client.ServerProxy(
-                url, verbose=False, allow_none=True,
-                context=simple_ssl_context())
+            self.pool = PlcConnectionPool.get_pool(
+                url, int(getattr(config, 'SFA_PLC_POOL_SIZE', 10)),
+                int(getattr(config, 'SFA_PLC_TIMEOUT', 120)))
+        # PLC.Shell objects are not thread-safe either
+        self.local = threading.local()
+
+    def call(self, method_name, *args, **kwds):
+        """
+        the raw call, arguments should include the auth if needed
+        """
+        if self.pool is not None:
+            return self.pool.call(method_name, *args, **kwds)
+        proxy = getattr(self.local, 'proxy', None)
+        if proxy is None:
+            import PLC.Shell
+            proxy = PLC.Shell.Shell()
+            self.local.proxy = proxy
+        return getattr(proxy, method_name)(*args, **kwds)
+
+    @staticmethod
+    def actual_name(name):
+        actual_name = None
+        if name in PlShell.direct_calls:
+            actual_name = name
+        if name in PlShell.alias_calls:
+            actual_name = PlShell.alias_calls[name]
+        if not actual_name:
+            raise Exception(
+                "Illegal method call %s for PL driver" % (name))
+        return actual_name
+
+    def batch(self, check=True):
+        """
+        to be used as
+
+        with shell.batch() as batch:
+            batch.AddRoleToPerson('user', person_id)
+            batch.AddPersonToSite(person_id, site_id)
+
+        see PlBatch
+        """
+        return PlBatch(self, check)
 
     def __getattr__(self, name):
         def func(*args, **kwds):
-            actual_name = None
-            if name in PlShell.direct_calls:
-                actual_name = name
-            if name in PlShell.alias_calls:
-                actual_name = PlShell.alias_calls[name]
-            if not actual_name:
-                raise Exception(
-                    "Illegal method call %s for PL driver" % (name))
-            result = getattr(self.proxy, actual_name)(
-                self.plauth, *args, **kwds)
+            actual_name = PlShell.actual_name(name)
+            if self.tables_cache is None:
+                result = self.call(actual_name, self.plauth, *args, **kwds)
+            elif actual_name in PlTablesCache.tables and not kwds:
+                result = self.tables_cache.get(
+                    actual_name, args,
+                    lambda: self.call(actual_name, self.plauth, *args))
+            else:
+                try:
+                    result = self.call(
+                        actual_name, self.plauth, *args, **kwds)
+                finally:
+                    self.tables_cache.wrote(actual_name)
             logger.debug('PlShell %s (%s) returned ... ' % (name, actual_name))
             return result
         return func
+
+
+class PlCall:
+    """
+    A call queued in a PlBatch; result() is available once the batch has run
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.done = False
+        self.value = None
+        self.fault = None
+
+    def set_result(self, value):
+        self.value = value
+        self.done = True
+
+    def set_fault(self, fault):
+        self.fault = fault
+        self.done = True
+
+    def result(self):
+        """
+        returns the value returned by PLCAPI, or raises the fault it sent
+        """
+        if not self.done:
+            raise Exception("PlCall %s has not run yet" % self.name)
+        if self.fault is not None:
+            raise self.fault
+        return self.value
+
+
+class PlBatch:
+    """
+    Queues PLCAPI calls, so they can be sent in a single system.multicall
+    request instead of one request per call; calls return a PlCall object.
+
+    PLCAPI runs the calls in order, but a failing call does not prevent
+    the next ones from running, so only independent calls should go in
+    the same batch. When check is set - the default - leaving the with
+    block raises the first fault, if any; otherwise it is up to the
+    caller to look at each PlCall.
+    """
+
+    def __init__(self, shell, check=True):
+        self.shell = shell
+        self.check = check
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # don't send anything if the block itself failed
+        if exc_type is None:
+            self.run()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        actual_name = PlShell.actual_name(name)
+
+        def func(*args):
+            call = PlCall(actual_name, args)
+            self.calls.append(call)
+            return call
+        return func
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return calls
+        shell = self.shell
+        if shell.direct_access:
+            # no network round trip to save in this case
+            for call in calls:
+                try:
+                    call.set_result(shell.call(
+                        call.name, shell.plauth, *call.args))
+                except Exception as e:
+                    call.set_fault(e)
+        else:
+            try:
+                results = shell.call(
+                    'system.multicall',
+                    [{'methodName': call.name,
+                      'params': [shell.plauth] + list(call.args)}
+                     for call in calls])
+            except Exception as e:
+                results = None
+                for call in calls:
+                    call.set_fault(e)
+            if results is not None:
+                for call, result in zip(calls, results):
+                    # a fault is a struct, a result is wrapped in a list
+                    if isinstance(result, dict):
+                        call.set_fault(xmlrpc.client.Fault(
+                            result['faultCode'], result['faultString']))
+                    else:
+                        call.set_result(result[0])
+        if shell.tables_cache is not None:
+            for call in calls:
+                shell.tables_cache.wrote(call.name)
+        logger.debug('PlBatch ran %d calls (%s)'
+                     % (len(calls), ", ".join(call.name for call in calls)))
+        if self.check:
+            for call in calls:
+                call.result()
+        return calls
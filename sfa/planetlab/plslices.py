@@ -149,7 +149,7 @@ class PlSlices:
         leases = self.driver.shell.GetLeases(
             {'name': slice['name'], 'clip': int(time.time())},
             ['lease_id', 'name', 'hostname', 't_from', 't_until'])
-        grain = self.driver.shell.GetLeaseGranularity()
+        grain = self.driver.get_lease_granularity()
 
         requested_leases = []
         for lease in rspec_requested_leases:
@@ -200,11 +200,14 @@ class PlSlices:
         added_leases = requested_leases
 
         try:
+            # the new leases may overlap the ones being deleted, so
+            # only add them once the deletion has gone through
             self.driver.shell.DeleteLeases(deleted_leases_id)
-            for lease in added_leases:
-                self.driver.shell.AddLeases(
-                    lease['hostname'], slice['name'],
-                    lease['t_from'], lease['t_until'])
+            with self.driver.shell.batch() as batch:
+                for lease in added_leases:
+                    batch.AddLeases(
+                        lease['hostname'], slice['name'],
+                        lease['t_from'], lease['t_until'])
 
         except Exception:
             logger.log_exc('Failed to add/remove slice leases')
@@ -247,7 +250,8 @@ class PlSlices:
         slices = self.driver.shell.GetSlices(slice['name'], ['node_ids'])
         resulting_nodes = self.driver.shell.GetNodes(slices[0]['node_ids'])
 
-        # update sliver allocations
+        # update sliver allocations, all at once
+        sliver_allocations = []
         for node in resulting_nodes:
             client_id = slivers[node['hostname']]['client_id']
             component_id = slivers[node['hostname']]['component_id']
@@ -258,7 +262,9 @@ class PlSlices:
                                       component_id=component_id,
                                       slice_urn=slice_urn,
                                       allocation_state='geni_allocated')
-            record.sync(self.driver.api.dbsession())
+            sliver_allocations.append(record)
+        SliverAllocation.sync_allocations(sliver_allocations,
+                                          self.driver.api.dbsession())
         return resulting_nodes
 
     def free_egre_key(self):
@@ -281,7 +287,7 @@ class PlSlices:
             return
 
         # exit if links are not supported here
-        topology = Topology()
+        topology = Topology.load()
         if not topology:
             return
 
@@ -543,8 +549,9 @@ class PlSlices:
             set(target_existing_person_ids)
 
         # delete
-        for person_id in del_person_ids:
-            self.driver.shell.DeletePersonFromSlice(person_id, slice_id)
+        with self.driver.shell.batch() as batch:
+            for person_id in del_person_ids:
+                batch.DeletePersonFromSlice(person_id, slice_id)
 
         # about the last 2 sets, for managing keys, we need to trace back person_id -> user
         # and for this we need all the Person objects; we already have the target_existing ones
@@ -564,9 +571,11 @@ class PlSlices:
 
         persons_to_verify_keys = {}
         # add
-        for person_id in add_person_ids:
-            self.driver.shell.AddPersonToSlice(person_id, slice_id)
-            persons_to_verify_keys[person_id] = user_by_person_id(person_id)
+        with self.driver.shell.batch() as batch:
+            for person_id in add_person_ids:
+                batch.AddPersonToSlice(person_id, slice_id)
+                persons_to_verify_keys[person_id] = user_by_person_id(
+                    person_id)
         # Update kept persons
         for person_id in keep_person_ids:
             persons_to_verify_keys[person_id] = user_by_person_id(person_id)
@@ -581,17 +590,29 @@ class PlSlices:
         if options is None:
             options = {}
         # we only add keys that comes from sfa to persons in PL
-        for person_id in persons_to_verify_keys:
-            person_sfa_keys = persons_to_verify_keys[person_id].get('keys', [])
-            person_pl_keys = self.driver.shell.GetKeys(
-                {'person_id': int(person_id)})
-            person_pl_keys_list = [key['key'] for key in person_pl_keys]
-
-            keys_to_add = set(person_sfa_keys).difference(person_pl_keys_list)
-
-            for key_string in keys_to_add:
-                key = {'key': key_string, 'key_type': 'ssh'}
-                self.driver.shell.AddPersonKey(int(person_id), key)
+        if not persons_to_verify_keys:
+            return
+        # fetch the keys of all persons at once
+        pl_keys_by_person_id = defaultdict(list)
+        for key in self.driver.shell.GetKeys(
+                {'person_id': [int(person_id)
+                               for person_id in persons_to_verify_keys]},
+                ['person_id', 'key']):
+            pl_keys_by_person_id[key['person_id']].append(key['key'])
+
+        # adding keys to different persons are independent calls
+        with self.driver.shell.batch() as batch:
+            for person_id in persons_to_verify_keys:
+                person_sfa_keys = persons_to_verify_keys[
+                    person_id].get('keys', [])
+                person_pl_keys_list = pl_keys_by_person_id[int(person_id)]
+
+                keys_to_add = set(person_sfa_keys).difference(
+                    person_pl_keys_list)
+
+                for key_string in keys_to_add:
+                    key = {'key': key_string, 'key_type': 'ssh'}
+                    batch.AddPersonKey(int(person_id), key)
 
     def verify_slice_tags(self, slice, requested_slice_attributes,
                           options=None, admin=False):
@@ -678,24 +699,34 @@ class PlSlices:
                 .format(slice['name'], tag_or_att['name'],
                         tag_or_att['value'], tag_or_att.get('node_id'))
 
-        # remove stale tags
-        for tag in slice_tags_to_remove:
-            try:
+        # failures are reported for each tag, so don't check the batch
+        with self.driver.shell.batch(check=False) as batch:
+            # remove stale tags
+            removals = []
+            for tag in slice_tags_to_remove:
                 logger.info("Removing Slice Tag {}".format(
                     friendly_message(tag)))
-                self.driver.shell.DeleteSliceTag(tag['slice_tag_id'])
-            except Exception as e:
-                logger.warning("Failed to remove slice tag {}\nCause:{}"
-                               .format(friendly_message(tag), e))
+                removals.append(
+                    (tag, batch.DeleteSliceTag(tag['slice_tag_id'])))
 
-        # add requested_tags
-        for attribute in slice_attributes_to_add:
-            try:
+            # add requested_tags
+            additions = []
+            for attribute in slice_attributes_to_add:
                 logger.info("Adding Slice Tag {}".format(
                     friendly_message(attribute)))
-                self.driver.shell.AddSliceTag(
+                additions.append((attribute, batch.AddSliceTag(
                     slice['name'], attribute['name'],
-                    attribute['value'], attribute.get('node_id', None))
+                    attribute['value'], attribute.get('node_id', None))))
+
+        for tag, call in removals:
+            try:
+                call.result()
+            except Exception as e:
+                logger.warning("Failed to remove slice tag {}\nCause:{}"
+                               .format(friendly_message(tag), e))
+        for attribute, call in additions:
+            try:
+                call.result()
             except Exception as e:
                 logger.warning("Failed to add slice tag {}\nCause:{}"
                                .format(friendly_message(attribute), e))
@@ -5,6 +5,7 @@
 # list of site_id tuples
 
 import os.path
+import threading
 import traceback
 from sfa.util.sfalogging import logger
 
@@ -14,8 +15,35 @@ class Topology(set):
     Parse the topology configuration file. 
     """
 
+    # config_file -> last loaded Topology
+    loaded = {}
+    lock = threading.Lock()
+
+    @staticmethod
+    def load(config_file="/etc/sfa/topology"):
+        """
+        Same as Topology(config_file), except that the file is parsed
+        again only when it has changed since the last call
+        """
+        try:
+            mtime = os.stat(config_file).st_mtime
+        except OSError:
+            mtime = None
+        with Topology.lock:
+            topology = Topology.loaded.get(config_file)
+            if topology is not None and mtime is not None \
+                    and topology.mtime == mtime:
+                return topology
+            # raises if the file cannot be read
+            topology = Topology(config_file)
+            topology.mtime = mtime
+            Topology.loaded[config_file] = topology
+            return topology
+
     def __init__(self, config_file="/etc/sfa/topology"):
         set.__init__(self)
+        self.config_file = config_file
+        self.mtime = None
         try:
             # load the links
             f = open(config_file, 'r')
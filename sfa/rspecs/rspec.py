@@ -3,6 +3,9 @@
 
 
 from datetime import datetime, timedelta
+from collections import namedtuple
+
+from lxml import etree
 
 from sfa.util.xml import XML, XpathFilter
 from sfa.util.faults import InvalidRSpecElement, InvalidRSpec
@@ -12,6 +15,11 @@ from sfa.rspecs.rspec_elements import RSpecElement, RSpecElements
 from sfa.rspecs.version_manager import VersionManager
 
 
+# a serialized element, together with the opening and closing tags
+# of the elements it needs to be wrapped in, outermost first
+RSpecFragment = namedtuple('RSpecFragment', ['wrappers', 'xml'])
+
+
 class RSpec:
 
     def __init__(self, rspec="", version=None, user_options=None, ttl=None, expires=None):
@@ -131,15 +139,167 @@ class RSpec:
                     parent = node.getparent()
                     parent.remove(node.element)
 
-    def toxml(self, header=True):
+    def toxml(self, header=True, pretty_print=True):
         if header:
-            return self.header + self.xml.toxml()
+            return self.header + self.xml.toxml(pretty_print)
         else:
-            return self.xml.toxml()
+            return self.xml.toxml(pretty_print)
 
     def save(self, filename):
         return self.xml.save(filename)
 
+    # the elements that write() renders by chunks
+    streamed_tags = ('node', 'link', 'lease')
+
+    def write(self, out, nodes=None, links=None, leases=None,
+              pretty_print=True, chunk_size=100):
+        """
+        Writes this rspec to the text stream out, together with nodes,
+        links and leases - any iterables, e.g. generators - as if they had
+        been added with version.add_nodes(), add_links() and add_leases()
+
+        The elements are rendered chunk_size at a time and written right
+        away, so unlike with toxml() the whole document never needs to be
+        held in memory as an lxml tree.
+
+        Items can also be RSpecFragment objects as returned by render(),
+        these are written as is.
+        """
+        root = self.xml.root.element
+        out.write(self.header)
+        root_open, root_close = self.split_element(root, None)
+        out.write(root_open)
+        if pretty_print:
+            out.write("\n")
+        for child in root:
+            out.write(self.element_string(child, pretty_print))
+        # the wrappers currently open in the output, outermost first
+        opened = []
+        for fragment in self.render(nodes, links, leases,
+                                    pretty_print, chunk_size):
+            wrappers = fragment.wrappers
+            # close what does not apply anymore, open what is missing
+            common = 0
+            while common < len(opened) and common < len(wrappers) \
+                    and opened[common] == wrappers[common]:
+                common += 1
+            for _, close in reversed(opened[common:]):
+                out.write(close)
+            del opened[common:]
+            for wrapper_open, wrapper_close in wrappers[common:]:
+                out.write(wrapper_open)
+                opened.append((wrapper_open, wrapper_close))
+            out.write(fragment.xml)
+        for _, close in reversed(opened):
+            out.write(close)
+        out.write(root_close)
+        if pretty_print:
+            out.write("\n")
+
+    def render(self, nodes=None, links=None, leases=None,
+               pretty_print=True, chunk_size=100):
+        """
+        Generates one RSpecFragment for each item in nodes, links and
+        leases, in this order; items that already are fragments are
+        passed through
+        """
+        # the elements are rendered in a separate rspec, and removed
+        # from it once serialized; in case they need to be wrapped,
+        # e.g. in a <network> element with SFA v1, the wrappers remain there
+        scratch = RSpec(version=type(self.version)())
+        scratch_root = scratch.xml.root.element
+        template_children = set(scratch_root)
+
+        def flush():
+            items = [elem for elem in scratch_root.iter()
+                     if self.is_streamed(elem)
+                     and not self.is_streamed(elem.getparent())
+                     and elem.getparent() is not None]
+            for item in items:
+                wrappers = []
+                parent = item.getparent()
+                while parent is not scratch_root:
+                    wrappers.insert(0, parent)
+                    parent = parent.getparent()
+                if wrappers and wrappers[0] in template_children:
+                    # not something we have added
+                    continue
+                tags = []
+                for wrapper in wrappers:
+                    wrapper_open, wrapper_close = self.split_element(
+                        wrapper, wrapper.getparent())
+                    if pretty_print:
+                        wrapper_open += "\n"
+                        wrapper_close += "\n"
+                    tags.append((wrapper_open, wrapper_close))
+                yield RSpecFragment(tuple(tags),
+                                    self.element_string(item, pretty_print))
+                item.getparent().remove(item)
+
+        for items, add in ((nodes, scratch.version.add_nodes),
+                           (links, scratch.version.add_links),
+                           (leases, scratch.version.add_leases)):
+            if items is None:
+                continue
+            chunk = []
+            for item in items:
+                if isinstance(item, RSpecFragment):
+                    # keep the order
+                    if chunk:
+                        add(chunk)
+                        chunk = []
+                        yield from flush()
+                    yield item
+                    continue
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    add(chunk)
+                    chunk = []
+                    yield from flush()
+            if chunk:
+                add(chunk)
+                yield from flush()
+
+    @staticmethod
+    def is_streamed(elem):
+        return elem is not None and isinstance(elem.tag, str) \
+            and etree.QName(elem).localname in RSpec.streamed_tags
+
+    @staticmethod
+    def strip_namespace_declarations(start_tag, parent):
+        """
+        lxml repeats all the namespace declarations in scope on an element
+        that is serialized on its own; the ones already made by parent
+        are not needed in the output
+        """
+        if parent is None:
+            return start_tag
+        for prefix, uri in parent.nsmap.items():
+            if prefix is None:
+                declaration = ' xmlns="%s"' % uri
+            else:
+                declaration = ' xmlns:%s="%s"' % (prefix, uri)
+            start_tag = start_tag.replace(declaration, '', 1)
+        return start_tag
+
+    def element_string(self, elem, pretty_print):
+        string = etree.tostring(elem, encoding='unicode',
+                                pretty_print=pretty_print)
+        cut = string.find('>')
+        return self.strip_namespace_declarations(
+            string[:cut], elem.getparent()) + string[cut:]
+
+    def split_element(self, elem, parent):
+        """
+        the opening and closing tags of elem, without its children
+        """
+        shallow = etree.Element(elem.tag, dict(elem.attrib), nsmap=elem.nsmap)
+        shallow.text = ''
+        string = etree.tostring(shallow, encoding='unicode')
+        cut = string.rfind('</')
+        return (self.strip_namespace_declarations(string[:cut], parent),
+                string[cut:])
+
 if __name__ == '__main__':
     import sys
     input = sys.argv[1]
@@ -15,8 +15,10 @@ class Aggregate(SfaServer):
     # @param port the port to listen on
     # @param key_file private key filename of registry
     # @param cert_file certificate filename containing public key (could be a GID file)
-    def __init__(self, ip, port, key_file, cert_file):
-        SfaServer.__init__(self, ip, port, key_file, cert_file, 'aggregate')
+    # @param mode either 'threaded' or 'asyncio', see SfaServer
+    def __init__(self, ip, port, key_file, cert_file, mode=None):
+        SfaServer.__init__(self, ip, port, key_file, cert_file, 'aggregate',
+                           mode=mode)
 
 #
 # Aggregates is a dictionary of aggregate connections keyed on the aggregate hrn
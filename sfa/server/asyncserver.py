@@ -0,0 +1,249 @@
+##
+# This module implements an asyncio-based alternative to ThreadedServer
+#
+# TLS, HTTP and the XML-RPC (de)serialization are all handled on an event
+# loop, so that idle or slow clients do not hold a thread; only the actual
+# SFA method calls - that talk to the db, the testbed or peer interfaces -
+# are run in a bounded thread pool.
+##
+
+import socket
+import asyncio
+import threading
+import concurrent.futures
+import xmlrpc.client
+
+from sfa.util.sfalogging import logger
+from sfa.util.config import Config
+from sfa.util.cache import Cache
+from sfa.trust.certificate import Certificate
+from sfa.server.threadedserver import server_ssl_context, gzip_response, \
+    fault_response, start_stats_reporter
+
+# don't hard code an api class anymore here
+from sfa.generic import Generic
+
+
+class AsyncServer:
+    """
+    Same interface as ThreadedServer as far as SfaServer is concerned:
+    it exposes interface, method_map, register_function() and
+    serve_forever()
+    """
+
+    # largest header section we accept
+    max_header_size = 64 * 1024
+    # largest request body we accept - rspecs and credentials included
+    max_body_size = 32 * 1024 * 1024
+
+    def __init__(self, server_address, key_file, cert_file):
+        logger.debug(
+            f"AsyncServer.__init__, server_address={server_address}, "
+            f"cert_file={cert_file}, key_file={key_file}")
+        self.server_address = server_address
+        self.interface = None
+        self.key_file = key_file
+        self.cert_file = cert_file
+        self.method_map = {}
+        self.funcs = {}
+        self.cache = Cache()
+        config = Config()
+        self.keepalive_timeout = int(
+            getattr(config, 'SFA_SERVER_KEEPALIVE_TIMEOUT', 15))
+        self.keepalive_max_requests = int(
+            getattr(config, 'SFA_SERVER_KEEPALIVE_MAX_REQUESTS', 100))
+        self.gzip_threshold = int(
+            getattr(config, 'SFA_SERVER_GZIP_THRESHOLD', 1400))
+        self.max_threads = int(
+            getattr(config, 'SFA_SERVER_MAX_THREADS', 25))
+        self.queue_size = int(
+            getattr(config, 'SFA_SERVER_QUEUE_SIZE', 50))
+        self.ssl_context = server_ssl_context(key_file, cert_file, config)
+        # bind right away, so that pre-forked workers share the socket
+        host, port = server_address
+        self.socket = socket.create_server((host, port))
+        self.api = None
+        self.api_lock = threading.Lock()
+        self.executor = None
+        # calls running or waiting for a thread
+        self.pending = 0
+        self.rejected = 0
+
+    def pool_stats(self):
+        """
+        a snapshot of the activity, as a dict
+        """
+        return {
+            'max_threads': self.max_threads,
+            'queue_size': self.queue_size,
+            'pending': self.pending,
+            'rejected': self.rejected,
+        }
+
+    def register_function(self, function, name=None):
+        # for compatibility with SimpleXMLRPCDispatcher
+        self.funcs[name or function.__name__] = function
+
+    def get_api(self):
+        if self.api is None:
+            with self.api_lock:
+                if self.api is None:
+                    generic = Generic.the_flavour()
+                    self.api = generic.make_api(
+                        interface=self.interface,
+                        key_file=self.key_file,
+                        cert_file=self.cert_file,
+                        cache=self.cache)
+        return self.api
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_threads, thread_name_prefix='sfa-async')
+        start_stats_reporter(self, Config())
+        loop = asyncio.get_running_loop()
+        # build the api before accepting connections
+        await loop.run_in_executor(self.executor, self.get_api)
+        server = await asyncio.start_server(
+            self.handle_connection, sock=self.socket,
+            ssl=self.ssl_context, limit=self.max_header_size)
+        logger.info("AsyncServer listening on {}".format(self.server_address))
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        remote_addr = writer.get_extra_info('peername')
+        peer_cert = Certificate()
+        peer_cert.load_from_pyopenssl_x509(writer.get_extra_info('peercert'))
+        timeout = self.keepalive_timeout or None
+        served = 0
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        asyncio.LimitOverrunError):
+                    break
+                served += 1
+                keep_alive = await self.handle_request(
+                    reader, writer, head, peer_cert, remote_addr)
+                if not keep_alive or not self.keepalive_timeout or \
+                        served >= self.keepalive_max_requests:
+                    break
+        except (ConnectionError, OSError):
+            logger.debug("AsyncServer: connection with {} lost"
+                         .format(remote_addr))
+        except Exception:
+            logger.log_exc("AsyncServer.handle_connection")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def handle_request(self, reader, writer, head,
+                             peer_cert, remote_addr):
+        """
+        Serves one HTTP request; returns whether the connection
+        can be used for another one
+        """
+        lines = head.decode('iso-8859-1').split("\r\n")
+        request_line = lines[0].split()
+        if len(request_line) != 3:
+            await self.send(writer, 400, b"", keep_alive=False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        keep_alive = request_line[2] == 'HTTP/1.1' \
+            and headers.get('connection', '').lower() != 'close'
+
+        if request_line[0] != 'POST':
+            await self.send(writer, 501, b"", keep_alive=False)
+            return False
+        try:
+            length = int(headers['content-length'])
+        except KeyError:
+            await self.send(writer, 411, b"", keep_alive=False)
+            return False
+        except ValueError:
+            await self.send(writer, 400, b"", keep_alive=False)
+            return False
+        if length < 0:
+            await self.send(writer, 400, b"", keep_alive=False)
+            return False
+        if length > self.max_body_size:
+            await self.send(writer, 413, b"", keep_alive=False)
+            return False
+        data = await reader.readexactly(length)
+
+        if self.pending >= self.max_threads + self.queue_size:
+            self.rejected += 1
+            logger.warning("AsyncServer: rejecting request from {} - "
+                           "{} calls pending, {} rejected so far"
+                           .format(remote_addr, self.pending, self.rejected))
+            await self.send(writer, 503, b"", keep_alive=False,
+                            extra_headers={'Retry-After': '1'})
+            return False
+
+        try:
+            encoding = headers.get('content-encoding', 'identity').lower()
+            if encoding == 'gzip':
+                data = xmlrpc.client.gzip_decode(data)
+            elif encoding != 'identity':
+                raise ValueError("unsupported Content-Encoding {}"
+                                 .format(encoding))
+            api = self.api.for_request(peer_cert=peer_cert,
+                                       remote_addr=remote_addr)
+            (method, args) = api.parse_request(data, self.method_map)
+            self.pending += 1
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.dispatch, api, remote_addr,
+                    method, args)
+            finally:
+                self.pending -= 1
+            response = api.prepare_response(result, method)
+        except Exception as fault:
+            logger.log_exc("AsyncServer.handle_request")
+            response = fault_response(fault)
+        body, encoding = gzip_response(
+            response.encode(), headers.get('accept-encoding', ''),
+            self.gzip_threshold)
+        await self.send(writer, 200, body, keep_alive,
+                        extra_headers={'Content-Encoding': encoding}
+                        if encoding else None)
+        return keep_alive
+
+    @staticmethod
+    def dispatch(api, remote_addr, method, args):
+        # runs in a worker thread
+        try:
+            return api.dispatch(remote_addr, method, args)
+        finally:
+            api.close_dbsession()
+
+    async def send(self, writer, code, body, keep_alive, extra_headers=None):
+        reasons = {200: 'OK', 400: 'Bad Request', 411: 'Length Required',
+                   413: 'Payload Too Large', 501: 'Not Implemented',
+                   503: 'Service Unavailable'}
+        headers = {
+            'Content-type': 'text/xml',
+            'Content-length': str(len(body)),
+        }
+        if not keep_alive:
+            headers['Connection'] = 'close'
+        if extra_headers:
+            headers.update(extra_headers)
+        head = "HTTP/1.1 {} {}\r\n".format(code, reasons[code])
+        head += "".join("{}: {}\r\n".format(name, value)
+                        for name, value in headers.items())
+        head += "\r\n"
+        writer.write(head.encode('iso-8859-1') + body)
+        await writer.drain()
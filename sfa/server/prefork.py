@@ -0,0 +1,96 @@
+"""
+Pre-fork mode for sfa-start.py
+
+The servers are created - and their listening sockets bound - in the
+main process, which then forks a number of worker processes that all
+accept connections on these same sockets. Each worker has its own
+threads, db connections and api/driver objects, so the load gets
+spread over several cores instead of being bound by a single GIL.
+
+The main process only watches the workers, and replaces the ones
+that die.
+"""
+
+import os
+import sys
+import time
+import signal
+
+from sfa.util.sfalogging import logger
+
+
+class Prefork:
+
+    # don't respawn a crashing worker more often than that
+    respawn_delay = 1
+
+    def __init__(self, servers, workers):
+        """
+        servers is a list of SfaServer instances, not started yet
+        """
+        self.servers = servers
+        self.workers = workers
+        # pid -> time of spawn
+        self.children = {}
+        self.stopping = False
+
+    def run(self):
+        self.before_fork()
+        for _ in range(self.workers):
+            self.spawn()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            spawned = self.children.pop(pid, None)
+            if spawned is None or self.stopping:
+                continue
+            logger.warning("Prefork: worker {} exited with status {}"
+                           " - respawning".format(pid, status))
+            if time.time() - spawned < self.respawn_delay:
+                time.sleep(self.respawn_delay)
+            self.spawn()
+
+    def stop(self, signum, frame):
+        logger.info("Prefork: stopping {} workers".format(len(self.children)))
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            logger.info("Prefork: started worker {}".format(pid))
+            return
+        # in the worker
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            for server in self.servers:
+                server.daemon = True
+                server.start()
+            for server in self.servers:
+                server.join()
+        except Exception:
+            logger.log_exc("Prefork: worker {} failed".format(os.getpid()))
+            status = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(status)
+
+    def before_fork(self):
+        # db connections opened so far - e.g. when checking the db schema -
+        # must not end up being shared by the workers
+        if 'sfa.storage.alchemy' in sys.modules:
+            from sfa.storage.alchemy import alchemy
+            alchemy.close_all()
@@ -19,9 +19,11 @@ class Registry(SfaServer):
     # @param port the port to listen on
     # @param key_file private key filename of registry
     # @param cert_file certificate filename containing public key (could be a GID file)
+    # @param mode either 'threaded' or 'asyncio', see SfaServer
 
-    def __init__(self, ip, port, key_file, cert_file):
-        SfaServer.__init__(self, ip, port, key_file, cert_file, 'registry')
+    def __init__(self, ip, port, key_file, cert_file, mode=None):
+        SfaServer.__init__(self, ip, port, key_file, cert_file, 'registry',
+                           mode=mode)
         sfa_config = Config()
         if Config().SFA_REGISTRY_ENABLED:
             from sfa.storage.alchemy import engine
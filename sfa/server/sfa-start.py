@@ -167,6 +167,14 @@ def main():
     parser.add_option("-t", "--trusted-certs",
                       dest="trusted_certs", action="store_true",
                       help="refresh trusted certs", default=False)
+    parser.add_option("-m", "--mode", dest="mode", action="store",
+                      choices=['threaded', 'asyncio'], default=None,
+                      help="server implementation, 'threaded' or 'asyncio'"
+                      " - defaults to SFA_SERVER_MODE")
+    parser.add_option("-w", "--workers", dest="workers", action="store",
+                      type="int", default=None,
+                      help="number of worker processes"
+                      " - defaults to SFA_SERVER_PROCESSES")
     (options, args) = parser.parse_args()
 
     config = Config()
@@ -186,18 +194,35 @@ def main():
     if options.trusted_certs:
         install_peer_certs(server_key_file, server_cert_file)
 
+    workers = options.workers
+    if workers is None:
+        workers = int(getattr(config, 'SFA_SERVER_PROCESSES', 1))
+    servers = []
+
     # start registry server
     if (options.registry):
         from sfa.server.registry import Registry
         r = Registry("", config.SFA_REGISTRY_PORT,
-                     server_key_file, server_cert_file)
-        r.start()
+                     server_key_file, server_cert_file, mode=options.mode)
+        servers.append(r)
 
     if (options.am):
         from sfa.server.aggregate import Aggregate
         a = Aggregate("", config.SFA_AGGREGATE_PORT,
-                      server_key_file, server_cert_file)
-        a.start()
+                      server_key_file, server_cert_file, mode=options.mode)
+        servers.append(a)
+
+    if workers > 1 and servers:
+        if options.am and config.SFA_AGGREGATE_CACHING and \
+           getattr(config, 'SFA_AGGREGATE_CACHE_BACKEND', 'memory') == 'memory':
+            logger.warning("running {} workers with an in-memory "
+                           "advertisement cache - each worker will build "
+                           "its own".format(workers))
+        from sfa.server.prefork import Prefork
+        Prefork(servers, workers).run()
+    else:
+        for server in servers:
+            server.start()
 
 if __name__ == "__main__":
     try:
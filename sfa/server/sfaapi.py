@@ -2,6 +2,7 @@
 
 import os
 import os.path
+import copy
 import datetime
 
 from sfa.util.faults import SfaFault, RecordNotFound
@@ -53,7 +54,8 @@ class SfaApi(XmlrpcApi):
         # Load configuration
         self.config = Config(config)
         self.credential = None
-        self.auth = Auth(peer_cert)
+        self.auth = Auth(peer_cert, config=self.config)
+        self.remote_addr = None
         self.interface = interface
         self.hrn = self.config.SFA_INTERFACE_HRN
         self.key_file = key_file
@@ -74,8 +76,29 @@ class SfaApi(XmlrpcApi):
 
         # filled later on by generic/Generic
         self.manager = None
+        self.driver = None
         self._dbsession = None
 
+    def for_request(self, peer_cert=None, remote_addr=None):
+        """
+        Return a copy of this object for handling one incoming request
+
+        The config, keys, registries, aggregates, manager and the
+        driver's connection to the testbed are built once per process
+        and shared; only the caller-related state (peer cert, remote
+        address, db session) is specific to the copy
+        """
+        api = copy.copy(self)
+        api.auth = self.auth.for_peer(peer_cert)
+        api.remote_addr = remote_addr
+        api.credential = None
+        api.source = None
+        api.protocol = None
+        api._dbsession = None
+        if self.driver is not None:
+            api.driver = self.driver.for_api(api)
+        return api
+
     def server_proxy(self, interface, cred, timeout=30):
         """
         Returns a connection to the specified interface. Use the specified
@@ -95,15 +118,17 @@ class SfaApi(XmlrpcApi):
         server = interface.server_proxy(key_file, cert_file, timeout)
         return server
 
+    # a request is served by a single thread,
+    # so it can use the thread's session
     def dbsession(self):
         if self._dbsession is None:
-            self._dbsession = alchemy.session()
+            self._dbsession = alchemy.thread_session()
         return self._dbsession
 
     def close_dbsession(self):
         if self._dbsession is None:
             return
-        alchemy.close_session(self._dbsession)
+        alchemy.close_thread_session()
         self._dbsession = None
 
     def getCredential(self, minimumExpiration=0):
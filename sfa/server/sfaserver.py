@@ -9,7 +9,9 @@ import threading
 from sfa.server.threadedserver import ThreadedServer, SecureXMLRpcRequestHandler
 
 from sfa.util.sfalogging import logger
+from sfa.util.config import Config
 from sfa.trust.certificate import Keypair, Certificate
+from sfa.trust.auth import configure_credential_cache
 
 ##
 # Implements an HTTPS XML-RPC server. Generally it is expected that SFA
@@ -30,17 +32,30 @@ class SfaServer(threading.Thread):
     # @param cert_file certificate filename containing public key
     #   (could be a GID file)
 
-    def __init__(self, ip, port, key_file, cert_file, interface):
+    # @param mode either 'threaded' or 'asyncio', defaults to the
+    #   SFA_SERVER_MODE config variable
+
+    def __init__(self, ip, port, key_file, cert_file, interface, mode=None):
         threading.Thread.__init__(self)
         self.key = Keypair(filename=key_file)
         self.cert = Certificate(filename=cert_file)
+        config = Config()
+        if mode is None:
+            mode = getattr(config, 'SFA_SERVER_MODE', 'threaded')
+        configure_credential_cache(config)
         #self.server = SecureXMLRPCServer((ip, port), SecureXMLRpcRequestHandler, key_file, cert_file)
-        self.server = ThreadedServer(
-            (ip, int(port)), SecureXMLRpcRequestHandler, key_file, cert_file)
+        if mode == 'asyncio':
+            from sfa.server.asyncserver import AsyncServer
+            self.server = AsyncServer((ip, int(port)), key_file, cert_file)
+        else:
+            self.server = ThreadedServer(
+                (ip, int(port)), SecureXMLRpcRequestHandler,
+                key_file, cert_file)
         self.server.interface = interface
         self.trusted_cert_list = None
         self.register_functions()
-        logger.info("Starting SfaServer, interface=%s" % interface)
+        logger.info("Starting SfaServer, interface=%s, mode=%s"
+                    % (interface, mode))
 
     ##
     # Register functions that will be served by the XMLRPC server. This
@@ -7,10 +7,11 @@
 ##
 
 import sys
+import time
 import socket
 import traceback
 import threading
-from queue import Queue
+from queue import Queue, Empty, Full
 import socketserver
 import ssl
 import http.server
@@ -19,7 +20,8 @@ import xmlrpc.client
 
 from sfa.util.sfalogging import logger
 from sfa.util.config import Config
-from sfa.util.cache import Cache
+from sfa.util.cache import Cache, LRUCache
+from sfa.util.faults import SfaFault, SfaAPIError
 from sfa.trust.certificate import Certificate
 from sfa.trust.trustedroots import TrustedRoots
 
@@ -82,6 +84,103 @@ def verify_callback(conn, x509, err, depth, preverify):
 
     return False
 
+##
+# the TLS setup shared by the threaded and the asyncio servers
+
+
+def server_ssl_context(key_file, cert_file, config):
+    ssl_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain(cert_file, key_file)
+    # If you wanted to verify certs against known CAs..
+    # this is how you would do it
+    # ssl_context.load_verify_locations('/etc/sfa/trusted_roots/plc.gpo.gid')
+    trusted_cert_files = TrustedRoots(
+        config.get_trustedroots_dir()).get_file_list()
+    cadata = ""
+    for cert_file in trusted_cert_files:
+        with open(cert_file) as cafile:
+            cadata += cafile.read()
+    ssl_context.load_verify_locations(cadata=cadata)
+#    ctx.set_verify(SSL.VERIFY_PEER |
+#                   SSL.VERIFY_FAIL_IF_NO_PEER_CERT, verify_callback)
+#    ctx.set_verify_depth(5)
+#    ctx.set_app_data(self)
+    return ssl_context
+
+
+def gzip_response(response, accept_encoding, threshold):
+    """
+    response is the encoded body of a reply; it gets gzipped if the
+    client has said it accepts gzip - like xmlrpc.client does by
+    default - and it is larger than threshold bytes, 0 meaning never
+
+    returns the body and the Content-Encoding header, if any
+    """
+    if threshold <= 0 or len(response) <= threshold:
+        return response, None
+    encodings = [encoding.split(';')[0].strip().lower()
+                 for encoding in accept_encoding.split(',')]
+    if 'gzip' not in encodings:
+        return response, None
+    return xmlrpc.client.gzip_encode(response), 'gzip'
+
+
+def fault_response(fault):
+    """
+    the xmlrpc answer for an exception raised while serving a request;
+    this does not need the per-request api, that may not exist yet
+    """
+    if not isinstance(fault, SfaFault):
+        fault = SfaAPIError(fault)
+    return xmlrpc.client.dumps(fault, methodresponse=True, allow_none=True)
+
+
+class StatsReporter(threading.Thread):
+    """
+    Logs the activity counters of the process every interval seconds:
+    the ones of the server's thread pool, of the db connection pool if
+    the db is used, and of the LRUCache objects that have a name - see
+    LRUCache.all_stats()
+    """
+
+    def __init__(self, server, interval):
+        threading.Thread.__init__(self, name='stats-reporter')
+        self.daemon = True
+        self.server = server
+        self.interval = interval
+
+    @staticmethod
+    def format(stats):
+        return ", ".join(
+            "{}={}".format(key, round(value, 3)
+                           if isinstance(value, float) else value)
+            for key, value in stats.items() if not isinstance(value, dict))
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.report()
+            except Exception:
+                logger.log_exc("StatsReporter")
+
+    def report(self):
+        logger.info("stats: server {}"
+                    .format(self.format(self.server.pool_stats())))
+        # don't connect to the db just for this
+        if 'sfa.storage.alchemy' in sys.modules:
+            from sfa.storage.alchemy import alchemy
+            logger.info("stats: db pool {}"
+                        .format(self.format(alchemy.pool_stats())))
+        for stats in LRUCache.all_stats():
+            logger.info("stats: cache {}".format(self.format(stats)))
+
+
+def start_stats_reporter(server, config):
+    interval = int(getattr(config, 'SFA_SERVER_STATS_INTERVAL', 600))
+    if interval > 0:
+        StatsReporter(server, interval).start()
+
 ##
 # taken from the web (XXX find reference). Implements HTTPS xmlrpc request
 # handler
@@ -96,59 +195,103 @@ class SecureXMLRpcRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
     but it uses HTTPS for transporting XML data.
     """
 
-    # porting to python3
-    # setup() no longer needed
+    # keep connections open so that clients can issue several
+    # calls without paying for a TLS handshake each time
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # idle timeout on the connection, applied by StreamRequestHandler
+        self.timeout = self.server.keepalive_timeout or None
+        self.requests_served = 0
+        xmlrpc.server.SimpleXMLRPCRequestHandler.setup(self)
+
+    def log_error(self, format, *args):
+        # mostly idle keep-alive connections that time out
+        logger.info("%s - %s" % (self.address_string(), format % args))
 
     def do_POST(self):
         """
         Handles the HTTPS POST request.
 
         It was copied out from SimpleXMLRPCServer.py and modified to shutdown
-        the socket cleanly.
+        the socket cleanly once the connection is no longer kept alive.
         """
+        self.requests_served += 1
+        keep_alive = self.server.keepalive_timeout > 0 and \
+            self.requests_served < self.server.keepalive_max_requests
+        # the per-request api, once it is created; this handler object
+        # is reused for all the requests on a keep-alive connection
+        self.api = None
+        request = None
+        response = None
         try:
+            request = self.rfile.read(int(self.headers["content-length"]))
+            request = self.decode_request(request)
             peer_cert = Certificate()
             peer_cert.load_from_pyopenssl_x509(
                 self.connection.getpeercert())
-            generic = Generic.the_flavour()
-            self.api = generic.make_api(peer_cert=peer_cert,
-                                        interface=self.server.interface,
-                                        key_file=self.server.key_file,
-                                        cert_file=self.server.cert_file,
-                                        cache=self.cache)
+            remote_addr = (
+                remote_ip, remote_port) = self.connection.getpeername()
+            self.api = self.server.get_api().for_request(
+                peer_cert=peer_cert, remote_addr=remote_addr)
             # logger.info("SecureXMLRpcRequestHandler.do_POST:")
             # logger.info("interface=%s"%self.server.interface)
             # logger.info("key_file=%s"%self.server.key_file)
             # logger.info("api=%s"%self.api)
             # logger.info("server=%s"%self.server)
             # logger.info("handler=%s"%self)
-            # get arguments
-            request = self.rfile.read(int(self.headers["content-length"]))
-            remote_addr = (
-                remote_ip, remote_port) = self.connection.getpeername()
-            self.api.remote_addr = remote_addr
             response = self.api.handle(
                 remote_addr, request, self.server.method_map)
         except Exception as fault:
             # This should only happen if the module is buggy
             # internal error, report as HTTP server error
             logger.log_exc("server.do_POST")
-            response = self.api.prepare_response(fault)
+            response = fault_response(fault)
             # self.send_response(500)
             # self.end_headers()
 
         # avoid session/connection leaks : do this no matter what
         finally:
+            if request is None:
+                # the body could not be read, the connection is unusable
+                keep_alive = False
+            if response is None:
+                response = fault_response(
+                    "request could not be served")
+            response, encoding = gzip_response(
+                response.encode(), self.headers.get("accept-encoding", ""),
+                self.server.gzip_threshold)
             self.send_response(200)
             self.send_header("Content-type", "text/xml")
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
             self.send_header("Content-length", str(len(response)))
+            if not keep_alive:
+                # this also sets self.close_connection
+                self.send_header("Connection", "close")
             self.end_headers()
-            self.wfile.write(response.encode())
+            self.wfile.write(response)
             self.wfile.flush()
             # close db connection
-            self.api.close_dbsession()
+            if self.api is not None:
+                self.api.close_dbsession()
             # shut down the connection
-            self.connection.shutdown(socket.SHUT_RDWR)  # Modified here!
+            if self.close_connection:
+                self.connection.shutdown(socket.SHUT_RDWR)  # Modified here!
+
+    def decode_request(self, request):
+        """
+        gunzips the request body if the client has sent it gzipped;
+        unlike decode_request_content() this raises an exception on
+        failure, for do_POST to answer with a fault
+        """
+        encoding = self.headers.get("content-encoding", "identity").lower()
+        if encoding == "gzip":
+            return xmlrpc.client.gzip_decode(request)
+        if encoding != "identity":
+            raise ValueError("unsupported Content-Encoding {}"
+                             .format(encoding))
+        return request
 
 ##
 # Taken from the web (XXX find reference). Implements an HTTPS xmlrpc server
@@ -175,25 +318,21 @@ class SecureXMLRPCServer(http.server.HTTPServer,
         self.method_map = {}
         # add cache to the request handler
         HandlerClass.cache = Cache()
+        config = Config()
+        # persistent connections, see SecureXMLRpcRequestHandler
+        self.keepalive_timeout = int(
+            getattr(config, 'SFA_SERVER_KEEPALIVE_TIMEOUT', 15))
+        self.keepalive_max_requests = int(
+            getattr(config, 'SFA_SERVER_KEEPALIVE_MAX_REQUESTS', 100))
+        self.gzip_threshold = int(
+            getattr(config, 'SFA_SERVER_GZIP_THRESHOLD', 1400))
+        # the api object is built on the first request, and then
+        # shared by all the requests served by this process
+        self.api = None
+        self.api_lock = threading.Lock()
         xmlrpc.server.SimpleXMLRPCDispatcher.__init__(self, True, None)
         socketserver.BaseServer.__init__(self, server_address, HandlerClass)
-        ssl_context = ssl.create_default_context(purpose=ssl.Purpose.CLIENT_AUTH)
-        ssl_context.load_cert_chain(cert_file, key_file)
-        # If you wanted to verify certs against known CAs..
-        # this is how you would do it
-        # ssl_context.load_verify_locations('/etc/sfa/trusted_roots/plc.gpo.gid')
-        config = Config()
-        trusted_cert_files = TrustedRoots(
-            config.get_trustedroots_dir()).get_file_list()
-        cadata = ""
-        for cert_file in trusted_cert_files:
-            with open(cert_file) as cafile:
-                cadata += cafile.read()
-        ssl_context.load_verify_locations(cadata=cadata)
-#        ctx.set_verify(SSL.VERIFY_PEER |
-#                       SSL.VERIFY_FAIL_IF_NO_PEER_CERT, verify_callback)
-#        ctx.set_verify_depth(5)
-#        ctx.set_app_data(self)
+        ssl_context = server_ssl_context(key_file, cert_file, config)
         # with python3 we use standard library SSLContext.wrap_socket()
         # instead of an OpenSSL.SSL.Connection object
         self.socket = ssl_context.wrap_socket(
@@ -202,6 +341,25 @@ class SecureXMLRPCServer(http.server.HTTPServer,
         self.server_bind()
         self.server_activate()
 
+    def get_api(self):
+        """
+        Return the api object for this server, creating it if needed
+
+        Config, keys, trusted roots, registries, aggregates and driver are
+        loaded once; the request handler uses api.for_request() to get
+        a copy attached to the incoming request
+        """
+        if self.api is None:
+            with self.api_lock:
+                if self.api is None:
+                    generic = Generic.the_flavour()
+                    self.api = generic.make_api(
+                        interface=self.interface,
+                        key_file=self.key_file,
+                        cert_file=self.cert_file,
+                        cache=self.RequestHandlerClass.cache)
+        return self.api
+
     # _dispatch
     #
     # Convert an exception on the server to a full stack trace and send it to
@@ -231,24 +389,45 @@ class SecureXMLRPCServer(http.server.HTTPServer,
 class ThreadPoolMixIn(socketserver.ThreadingMixIn):
     """
     use a thread pool instead of a new thread on every request
+
+    The pool starts with min_threads workers and grows up to max_threads
+    when all workers are busy; extra workers that stay idle for
+    thread_idle_timeout seconds go away. Accepted connections wait in
+    a queue of at most queue_size entries; when it is full, new
+    connections are turned down right away with a 503 instead of
+    piling up. All these are read from the config in serve_forever().
     """
-    # XX TODO: Make this configurable
-    # config = Config()
-    # numThreads = config.SFA_SERVER_NUM_THREADS
-    numThreads = 25
+    min_threads = 5
+    max_threads = 25
+    queue_size = 50
+    thread_idle_timeout = 60
     allow_reuse_address = True  # seems to fix socket.error on server restart
 
     def serve_forever(self):
         """
         Handle one request at a time until doomsday.
         """
+        config = Config()
+        self.max_threads = int(getattr(
+            config, 'SFA_SERVER_MAX_THREADS', self.max_threads))
+        self.min_threads = min(self.max_threads, int(getattr(
+            config, 'SFA_SERVER_MIN_THREADS', self.min_threads)))
+        self.queue_size = int(getattr(
+            config, 'SFA_SERVER_QUEUE_SIZE', self.queue_size))
         # set up the threadpool
-        self.requests = Queue()
-
-        for _ in range(self.numThreads):
-            thread = threading.Thread(target=self.process_request_thread)
-            thread.setDaemon(1)
-            thread.start()
+        self.requests = Queue(self.queue_size)
+        self.pool_lock = threading.Lock()
+        # thread name -> per-worker metrics
+        self.workers = {}
+        self.idle_workers = 0
+        self.rejected = 0
+        self.served = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+
+        for _ in range(self.min_threads):
+            self.start_worker()
+        start_stats_reporter(self, config)
 
         # server main loop
         while True:
@@ -256,13 +435,49 @@ class ThreadPoolMixIn(socketserver.ThreadingMixIn):
 
         self.server_close()
 
+    def start_worker(self):
+        # to be called with pool_lock held, or before serving
+        thread = threading.Thread(target=self.process_request_thread)
+        thread.daemon = True
+        self.workers[thread.name] = {'busy': False, 'served': 0,
+                                     'busy_time': 0.}
+        self.idle_workers += 1
+        thread.start()
+
     def process_request_thread(self):
         """
         obtain request from queue instead of directly from server socket
         """
+        name = threading.current_thread().name
+        worker = self.workers[name]
         while True:
-            socketserver.ThreadingMixIn.process_request_thread(
-                self, *self.requests.get())
+            try:
+                request, client_address, queued = self.requests.get(
+                    timeout=self.thread_idle_timeout)
+            except Empty:
+                with self.pool_lock:
+                    if len(self.workers) > self.min_threads:
+                        del self.workers[name]
+                        self.idle_workers -= 1
+                        return
+                continue
+            started = time.time()
+            wait = started - queued
+            with self.pool_lock:
+                self.idle_workers -= 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            worker['busy'] = True
+            try:
+                socketserver.ThreadingMixIn.process_request_thread(
+                    self, request, client_address)
+            finally:
+                worker['busy'] = False
+                worker['served'] += 1
+                worker['busy_time'] += time.time() - started
+                with self.pool_lock:
+                    self.idle_workers += 1
+                    self.served += 1
 
     def handle_request(self):
         """
@@ -272,8 +487,59 @@ class ThreadPoolMixIn(socketserver.ThreadingMixIn):
             request, client_address = self.get_request()
         except socket.error:
             return
-        if self.verify_request(request, client_address):
-            self.requests.put((request, client_address))
+        if not self.verify_request(request, client_address):
+            self.shutdown_request(request)
+            return
+        with self.pool_lock:
+            if self.idle_workers <= self.requests.qsize() \
+                    and len(self.workers) < self.max_threads:
+                self.start_worker()
+        try:
+            self.requests.put_nowait((request, client_address, time.time()))
+        except Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """
+        the pool is saturated, tell the client to come back later
+        """
+        self.rejected += 1
+        stats = self.pool_stats()
+        logger.warning("ThreadPoolMixIn: rejecting request from {} - "
+                       "{busy}/{threads} threads busy, {queue_depth} queued, "
+                       "{rejected} rejected so far"
+                       .format(client_address, **stats))
+        try:
+            request.settimeout(1)
+            request.sendall(b"HTTP/1.1 503 Service Unavailable\r\n"
+                            b"Retry-After: 1\r\n"
+                            b"Content-Length: 0\r\n"
+                            b"Connection: close\r\n\r\n")
+        except (socket.error, ValueError):
+            pass
+        self.shutdown_request(request)
+
+    def pool_stats(self):
+        """
+        a snapshot of the pool activity, as a dict
+        """
+        with self.pool_lock:
+            served = self.served
+            return {
+                'threads': len(self.workers),
+                'min_threads': self.min_threads,
+                'max_threads': self.max_threads,
+                'busy': len(self.workers) - self.idle_workers,
+                'idle': self.idle_workers,
+                'queue_depth': self.requests.qsize(),
+                'queue_size': self.queue_size,
+                'served': served,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / served if served else 0.,
+                'max_wait': self.max_wait,
+                'workers': {name: dict(worker)
+                            for name, worker in self.workers.items()},
+            }
 
 
 class ThreadedServer(ThreadPoolMixIn, SecureXMLRPCServer):
@@ -143,7 +143,16 @@ class XmlrpcApi:
         """
         Handle an XML-RPC or SOAP request from the specified source.
         """
-        # Parse request into method name and arguments
+        (method, args) = self.parse_request(data, method_map)
+        result = self.dispatch(source, method, args)
+        # Return result
+        response = self.prepare_response(result, method)
+        return response
+
+    def parse_request(self, data, method_map):
+        """
+        Parse request into method name and arguments
+        """
         try:
             interface = xmlrpc.client
             self.protocol = 'xmlrpc'
@@ -163,7 +172,12 @@ class XmlrpcApi:
                 # XXX Support named arguments
             else:
                 raise e
+        return (method, args)
 
+    def dispatch(self, source, method, args):
+        """
+        Call the method, returning either its result or a fault
+        """
         try:
             result = self.call(source, method, *args)
         except SfaFault as fault:
@@ -172,10 +186,7 @@ class XmlrpcApi:
         except Exception as fault:
             logger.log_exc("XmlrpcApi.handle has caught Exception")
             result = SfaAPIError(fault)
-
-        # Return result
-        response = self.prepare_response(result, method)
-        return response
+        return result
 
     def prepare_response(self, result, method=""):
         """
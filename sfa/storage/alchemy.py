@@ -1,5 +1,5 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker, scoped_session
 
 from sqlalchemy import Column, Integer, String
 from sqlalchemy import ForeignKey
@@ -29,12 +29,23 @@ class Alchemy:
         tcp_url = "postgresql+psycopg2://%s:%s@%s:%s/%s" %\
             (config.SFA_DB_USER, config.SFA_DB_PASSWORD,
              config.SFA_DB_HOST, config.SFA_DB_PORT, dbname)
+        # connections are pooled, see the sfa_db category in the config
+        pool_settings = {
+            'pool_size': int(getattr(config, 'SFA_DB_POOL_SIZE', 5)),
+            'max_overflow': int(getattr(config, 'SFA_DB_MAX_OVERFLOW', 10)),
+            'pool_recycle': int(getattr(config, 'SFA_DB_POOL_RECYCLE', 3600)),
+            'pool_pre_ping': getattr(config, 'SFA_DB_POOL_PRE_PING', True),
+        }
         for url in [unix_url, tcp_url]:
             try:
                 logger.debug("Trying db URL %s" % url)
-                self.engine = create_engine(url)
+                self.engine = create_engine(url, **pool_settings)
                 self.check()
                 self.url = url
+                # the one session factory, and the registry of the
+                # sessions used by the threads that serve requests
+                self.Session = sessionmaker(bind=self.engine)
+                self.scoped_sessions = scoped_session(self.Session)
                 return
             except:
                 pass
@@ -47,12 +58,12 @@ class Alchemy:
         self.engine.echo = echo
 
     def check(self):
-        self.engine.execute("select 1").scalar()
+        with self.engine.connect() as connection:
+            connection.execute(text("select 1")).scalar()
 
     def global_session(self):
         if self._session is None:
-            Session = sessionmaker()
-            self._session = Session(bind=self.engine)
+            self._session = self.Session()
             logger.debug('alchemy.global_session created session %s' %
                          self._session)
         return self._session
@@ -66,8 +77,7 @@ class Alchemy:
 
     # create a dbsession to be managed separately
     def session(self):
-        Session = sessionmaker()
-        session = Session(bind=self.engine)
+        session = self.Session()
         logger.debug('alchemy.session created session %s' % session)
         return session
 
@@ -75,6 +85,36 @@ class Alchemy:
         logger.debug('alchemy.close_session closed session %s' % session)
         session.close()
 
+    # the dbsession of the current thread, created on the first call
+    # the thread is done with it with close_thread_session
+    def thread_session(self):
+        return self.scoped_sessions()
+
+    def close_thread_session(self):
+        # this gives the connection back to the pool
+        self.scoped_sessions.remove()
+
+    def pool_stats(self):
+        """
+        the state of the connection pool, as a dict; the servers log
+        this periodically, see SFA_SERVER_STATS_INTERVAL
+        """
+        pool = self.engine.pool
+        stats = {}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
+
+    # close all the connections to the db, e.g. before forking,
+    # as connections must not be shared between processes
+    # the global session remains usable, and will reconnect as needed
+    def close_all(self):
+        if self._session is not None:
+            self._session.close()
+        self.scoped_sessions.remove()
+        self.engine.dispose()
+
 ####################
 from sfa.util.config import Config
 
@@ -0,0 +1,27 @@
+# this move is about adding indexes on the columns that the registry uses
+# to look records up - see RegRecord in sfa.storage.model
+
+from sqlalchemy import MetaData, Table, Index
+
+
+def records_indexes(migrate_engine):
+    metadata = MetaData(bind=migrate_engine)
+    records = Table('records', metadata, autoload=True)
+    return [
+        Index('records_hrn_type_idx', records.c.hrn, records.c.type),
+        Index('records_authority_idx', records.c.authority),
+        Index('records_pointer_idx', records.c.pointer),
+        # for the hrn LIKE 'prefix%' of recursive List
+        Index('records_hrn_pattern_idx', records.c.hrn,
+              postgresql_ops={'hrn': 'text_pattern_ops'}),
+    ]
+
+
+def upgrade(migrate_engine):
+    for index in records_indexes(migrate_engine):
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    for index in records_indexes(migrate_engine):
+        index.drop(migrate_engine)
@@ -2,11 +2,12 @@ from datetime import datetime
 
 from sqlalchemy import or_, and_
 from sqlalchemy import Column, Integer, String, DateTime
-from sqlalchemy import Table, Column, MetaData, join, ForeignKey
+from sqlalchemy import Table, Column, MetaData, join, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.orm import column_property
 from sqlalchemy.orm import object_mapper
 from sqlalchemy.orm import validates
+from sqlalchemy.orm import selectinload, with_polymorphic
 from sqlalchemy.ext.declarative import declarative_base
 
 from sfa.storage.record import Record
@@ -14,7 +15,7 @@ from sfa.util.sfalogging import logger
 from sfa.util.sfatime import utcparse, datetime_to_string
 from sfa.util.xml import XML
 
-from sfa.trust.gid import GID
+from sfa.trust.gid import gid_from_string
 
 ##############################
 Base = declarative_base()
@@ -94,6 +95,18 @@ class RegRecord(Base, AlchemyObj):
     last_updated = Column(DateTime)
     # use the 'type' column to decide which subclass the object is of
     __mapper_args__ = {'polymorphic_on': classtype}
+    # the registry looks records up by hrn and type, by authority - e.g.
+    # List - and by pointer; recursive List looks for hrns that start
+    # with a prefix, which takes an index with text_pattern_ops with
+    # postgresql, unless the db uses the C locale
+    # these are created by migration 005 on existing dbs
+    __table_args__ = (
+        Index('records_hrn_type_idx', 'hrn', 'type'),
+        Index('records_authority_idx', 'authority'),
+        Index('records_pointer_idx', 'pointer'),
+        Index('records_hrn_pattern_idx', 'hrn',
+              postgresql_ops={'hrn': 'text_pattern_ops'}),
+    )
 
     fields = ['type', 'hrn', 'gid', 'authority', 'peer_authority']
 
@@ -170,7 +183,7 @@ class RegRecord(Base, AlchemyObj):
         if not self.gid:
             return None
         else:
-            return GID(string=self.gid)
+            return gid_from_string(self.gid)
 
     def just_created(self):
         now = datetime.utcnow()
@@ -410,64 +423,85 @@ class SliverAllocation(Base, AlchemyObj):
                  % (self.sliver_id, self.allocation_state)
         return result
 
+    allocation_states = ['geni_unallocated',
+                         'geni_allocated', 'geni_provisioned']
+
+    # the columns that are written by sync_allocations
+    sync_columns = ['client_id', 'component_id', 'slice_urn',
+                    'allocation_state']
+
     @validates('allocation_state')
     def validate_allocation_state(self, key, state):
-        allocation_states = ['geni_unallocated',
-                             'geni_allocated', 'geni_provisioned']
-        assert state in allocation_states
+        assert state in SliverAllocation.allocation_states
         return state
 
+    # the statements below are set-based, i.e. they cost one round trip
+    # to the db whatever the number of slivers, rather than one per sliver
+    @staticmethod
+    def upsert(dbsession):
+        """
+        an INSERT ... ON CONFLICT statement, as supported by postgresql -
+        and sqlite, which is convenient for tests
+        """
+        if dbsession.get_bind().dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        return insert(SliverAllocation.__table__)
+
     @staticmethod
     def set_allocations(sliver_ids, state, dbsession):
         if not isinstance(sliver_ids, list):
             sliver_ids = [sliver_ids]
-        sliver_state_updated = {}
-        constraint = SliverAllocation.sliver_id.in_(sliver_ids)
-        sliver_allocations = dbsession.query(
-            SliverAllocation).filter(constraint)
-        sliver_ids_found = []
-        for sliver_allocation in sliver_allocations:
-            sliver_allocation.allocation_state = state
-            sliver_ids_found.append(sliver_allocation.sliver_id)
-
-        # Some states may not have been updated becuase no sliver allocation state record
-        # exists for the sliver. Insert new allocation records for these slivers and set
-        # it to geni_allocated.
-        sliver_ids_not_found = set(sliver_ids).difference(sliver_ids_found)
-        for sliver_id in sliver_ids_not_found:
-            record = SliverAllocation(
-                sliver_id=sliver_id, allocation_state=state)
-            dbsession.add(record)
+        assert state in SliverAllocation.allocation_states
+        if not sliver_ids:
+            return
+        # slivers that have no allocation record yet get one
+        statement = SliverAllocation.upsert(dbsession).values(
+            [{'sliver_id': sliver_id, 'allocation_state': state}
+             for sliver_id in set(sliver_ids)])
+        statement = statement.on_conflict_do_update(
+            index_elements=['sliver_id'],
+            set_={'allocation_state': statement.excluded.allocation_state})
+        dbsession.execute(statement)
         dbsession.commit()
 
     @staticmethod
     def delete_allocations(sliver_ids, dbsession):
         if not isinstance(sliver_ids, list):
             sliver_ids = [sliver_ids]
+        if not sliver_ids:
+            return
         constraint = SliverAllocation.sliver_id.in_(sliver_ids)
-        sliver_allocations = dbsession.query(
-            SliverAllocation).filter(constraint)
+        dbsession.query(SliverAllocation).filter(constraint)\
+            .delete(synchronize_session=False)
+        dbsession.commit()
+
+    @staticmethod
+    def sync_allocations(sliver_allocations, dbsession):
+        """
+        insert or update a list of SliverAllocation objects
+        """
+        # the last one wins, as with successive calls to sync()
+        rows = {}
         for sliver_allocation in sliver_allocations:
-            dbsession.delete(sliver_allocation)
+            row = {column: getattr(sliver_allocation, column)
+                   for column in SliverAllocation.sync_columns}
+            row['sliver_id'] = sliver_allocation.sliver_id
+            rows[sliver_allocation.sliver_id] = row
+        if not rows:
+            return
+        statement = SliverAllocation.upsert(dbsession).values(
+            list(rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=['sliver_id'],
+            set_={column: getattr(statement.excluded, column)
+                  for column in SliverAllocation.sync_columns})
+        dbsession.execute(statement)
         dbsession.commit()
 
     def sync(self, dbsession):
-        constraints = [SliverAllocation.sliver_id == self.sliver_id]
-        results = dbsession.query(SliverAllocation).filter(and_(*constraints))
-        records = []
-        for result in results:
-            records.append(result)
-
-        if not records:
-            dbsession.add(self)
-        else:
-            record = records[0]
-            record.sliver_id = self.sliver_id
-            record.client_id = self.client_id
-            record.component_id = self.component_id
-            record.slice_urn = self.slice_urn
-            record.allocation_state = self.allocation_state
-        dbsession.commit()
+        SliverAllocation.sync_allocations([self], dbsession)
 
 
 ##############################
@@ -546,6 +580,31 @@ augment_map = {'authority': {'reg-pis': 'reg_pis', },
                }
 
 
+# the classes that have relationships in augment_map
+augment_classes = {'authority': 'RegAuthority',
+                   'slice': 'RegSlice',
+                   'user': 'RegUser',
+                   }
+
+
+def augmented_records_query(dbsession):
+    """
+    A query on RegRecord that loads upfront everything that
+    augment_with_sfa_builtins needs, i.e. the columns of all subclasses,
+    the relationships in augment_map and the users keys
+
+    This takes a fixed number of SELECTs whatever the number of records,
+    where the lazy loads would issue several per record; use it
+    like dbsession.query(RegRecord), e.g. with filter() or filter_by()
+    """
+    records = with_polymorphic(RegRecord, '*')
+    options = [selectinload(records.RegUser.reg_keys)]
+    for type, type_map in augment_map.items():
+        subclass = getattr(records, augment_classes[type])
+        for attribute in type_map.values():
+            options.append(selectinload(getattr(subclass, attribute)))
+    return dbsession.query(records).options(*options)
+
 # xxx mystery
 # the way we use sqlalchemy might be a little wrong
 # in any case what has been observed is that (Reg)Records as returned by an sqlalchemy
@@ -558,6 +617,7 @@ augment_map = {'authority': {'reg-pis': 'reg_pis', },
 # that such built-in fields are properly set in __dict__ too
 #
 def augment_with_sfa_builtins(local_record):
+    # on records from augmented_records_query() this issues no query
     # don't ruin the import of that file in a client world
     from sfa.util.xrn import Xrn
     # add a 'urn' field
@@ -1,7 +1,12 @@
 #
 # SfaAPI authentication
 #
+import os
 import sys
+import copy
+import threading
+import calendar
+import hashlib
 
 from sfa.util.faults import InsufficientRights, MissingCallerGID, \
     MissingTrustedRoots, PermissionError, BadRequestHash, \
@@ -9,17 +14,35 @@ from sfa.util.faults import InsufficientRights, MissingCallerGID, \
     Forbidden, BadArgs
 from sfa.util.sfalogging import logger
 from sfa.util.config import Config
+from sfa.util.cache import LRUCache
 from sfa.util.xrn import Xrn, get_authority
 
-from sfa.trust.gid import GID
+from sfa.trust.gid import GID, gid_from_string
 from sfa.trust.rights import Rights
 from sfa.trust.certificate import Keypair, Certificate
 from sfa.trust.credential import Credential
-from sfa.trust.trustedroots import TrustedRoots
+from sfa.trust.credential_verifier import get_verifier
+from sfa.trust.trustedroots import TrustedRoots, TrustedCerts
 from sfa.trust.hierarchy import Hierarchy
 from sfa.trust.sfaticket import SfaTicket
 from sfa.trust.speaksfor_util import determine_speaks_for
 
+# credentials that have passed Credential.verify(), shared by all
+# Auth instances in the process; see Auth.check()
+verified_credentials = LRUCache(max_size=1000, ttl=600,
+                                name='verified_credentials')
+
+
+def configure_credential_cache(config):
+    """
+    Size the verified_credentials cache after SFA_CREDENTIAL_CACHE_SIZE
+    and SFA_CREDENTIAL_CACHE_TTL; called once, when the server is set up
+    """
+    verified_credentials.max_size = int(getattr(
+        config, 'SFA_CREDENTIAL_CACHE_SIZE', verified_credentials.max_size))
+    verified_credentials.ttl = int(getattr(
+        config, 'SFA_CREDENTIAL_CACHE_TTL', verified_credentials.ttl))
+
 
 class Auth:
     """
@@ -28,16 +51,79 @@ class Auth:
 
     def __init__(self, peer_cert=None, config=None):
         self.peer_cert = peer_cert
+        self.config = config if config else Config()
+        # one of the backends in sfa.trust.credential_verifier; a typo
+        # in the config is reported here rather than on the first call
+        self.credential_verifier = get_verifier(getattr(
+            self.config, 'SFA_CREDENTIAL_VERIFIER', 'auto'))
         self.hierarchy = Hierarchy()
-        if not config:
-            self.config = Config()
+        # shared with the copies made by for_peer
+        self.trusted_certs_lock = threading.Lock()
         self.load_trusted_certs()
 
+    def for_peer(self, peer_cert):
+        """
+        Return a copy of this object for handling one incoming request
+
+        The trusted roots and hierarchy are shared with this object, only
+        the state about the caller is specific to the copy
+        """
+        self.refresh_trusted_certs()
+        with self.trusted_certs_lock:
+            auth = copy.copy(self)
+        auth.peer_cert = peer_cert
+        for attr in ('client_cred', 'client_gid', 'object_gid'):
+            auth.__dict__.pop(attr, None)
+        return auth
+
+    def trusted_roots_mtime(self):
+        try:
+            return os.stat(self.config.get_trustedroots_dir()).st_mtime
+        except OSError:
+            return None
+
+    def refresh_trusted_certs(self):
+        """
+        Reload the trusted roots if files were added to or removed from
+        the trusted roots directory since they were loaded
+        """
+        if self.trusted_roots_mtime() != self.trusted_certs_mtime:
+            logger.info("Auth: reloading trusted roots from {}"
+                        .format(self.config.get_trustedroots_dir()))
+            self.load_trusted_certs()
+
     def load_trusted_certs(self):
-        self.trusted_cert_list = \
-            TrustedRoots(self.config.get_trustedroots_dir()).get_list()
-        self.trusted_cert_file_list = \
+        mtime = self.trusted_roots_mtime()
+        trusted_cert_file_list = \
             TrustedRoots(self.config.get_trustedroots_dir()).get_file_list()
+        trusted_cert_list = TrustedCerts(
+            GID(filename=cert_file) for cert_file in trusted_cert_file_list)
+        # a verified credential is only valid wrt a given set of roots
+        digest = hashlib.sha256()
+        for pem in sorted(gid.save_to_string(save_parents=True)
+                          for gid in trusted_cert_list):
+            digest.update(pem.encode())
+        with self.trusted_certs_lock:
+            self.trusted_cert_file_list = trusted_cert_file_list
+            self.trusted_cert_list = trusted_cert_list
+            self.trusted_roots_digest = digest.hexdigest()
+            self.trusted_certs_mtime = mtime
+
+    def verified_credential_key(self, credential):
+        """
+        The key for this credential in the verified_credentials cache,
+        or None if it cannot be cached
+        """
+        cred_type = Credential.SFA_CREDENTIAL_TYPE
+        if isinstance(credential, dict):
+            cred_type = credential.get('geni_type')
+            credential = credential.get('geni_value')
+        if isinstance(credential, str):
+            credential = credential.encode()
+        if not isinstance(credential, bytes):
+            return None
+        return (hashlib.sha256(credential).hexdigest(),
+                cred_type, self.trusted_roots_digest)
 
     # this convenience methods extracts speaking_for_xrn
     # from the passed options using 'geni_speaking_for'
@@ -149,10 +235,19 @@ class Auth:
         trusted cert and check if the credential is allowed to perform
         the specified operation.
         """
-        cred = Credential(cred=credential)
+        # a credential that was verified already needs neither parsing
+        # nor signature and chain checks until it expires
+        cache_key = self.verified_credential_key(credential)
+        cred = None
+        if cache_key:
+            cred = verified_credentials.get(cache_key)
+        verified = cred is not None
+        if not verified:
+            cred = Credential(cred=credential)
         self.client_cred = cred
-        logger.debug("Auth.check: handling hrn=%s and credential=%s" %
-                     (hrn, cred.pretty_cred()))
+        logger.debug("Auth.check: handling hrn=%s and credential=%s "
+                     "(verified cache %s)" %
+                     (hrn, cred.pretty_cred(), "hit" if verified else "miss"))
 
         if cred.type not in ['geni_sfa']:
             raise CredentialNotVerifiable(
@@ -173,11 +268,18 @@ class Auth:
             if not self.client_cred.can_perform(operation):
                 raise InsufficientRights(operation)
 
-        if self.trusted_cert_list:
-            self.client_cred.verify(self.trusted_cert_file_list,
-                                    self.config.SFA_CREDENTIAL_SCHEMA)
-        else:
+        if not self.trusted_cert_list:
             raise MissingTrustedRoots(self.config.get_trustedroots_dir())
+        if not verified:
+            self.client_cred.verify(self.trusted_cert_file_list,
+                                    self.config.SFA_CREDENTIAL_SCHEMA,
+                                    verifier=self.credential_verifier,
+                                    trusted_cert_objects=self.trusted_cert_list)
+            if cache_key:
+                expires = calendar.timegm(
+                    self.client_cred.get_expiration().utctimetuple())
+                verified_credentials.add(cache_key, self.client_cred,
+                                         expires=expires)
 
         # Make sure the credential's target matches the specified hrn.
         # This check does not apply to trusted peers
@@ -222,10 +324,12 @@ class Auth:
 
     def validateCred(self, cred):
         if self.trusted_cert_list:
-            cred.verify(self.trusted_cert_file_list)
+            cred.verify(self.trusted_cert_file_list,
+                        verifier=self.credential_verifier,
+                        trusted_cert_objects=self.trusted_cert_list)
 
     def authenticateGid(self, gidStr, argList, requestHash=None):
-        gid = GID(string=gidStr)
+        gid = gid_from_string(gidStr)
         self.validateGid(gid)
         # request_hash is optional
         if requestHash:
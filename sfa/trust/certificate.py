@@ -834,7 +834,8 @@ class Certificate:
     # a trusted root, then an exception is thrown.
     # Also require that parents are CAs.
     #
-    # @param Trusted_certs is a list of certificates that are trusted.
+    # @param Trusted_certs is a list of certificates that are trusted,
+    #     or a sfa.trust.trustedroots.TrustedCerts store
     #
 
     def verify_chain(self, trusted_certs=None):
@@ -850,11 +851,22 @@ class Certificate:
             raise CertExpired(self.pretty_cert(), "client cert")
 
         # if this cert is signed by a trusted_cert, then we are set
-        for i, trusted_cert in enumerate(trusted_certs, 1):
+        # when given a TrustedCerts store, only try the roots that
+        # match our issuer - unless that leaves us with nothing to try
+        # at the top of the chain, in which case try them all as before
+        if hasattr(trusted_certs, 'issuers_of'):
+            candidates = trusted_certs.issuers_of(self)
+            if not candidates and not self.parent:
+                candidates = trusted_certs
+            is_signed_by = trusted_certs.is_signed_by
+        else:
+            candidates = trusted_certs
+            is_signed_by = Certificate.is_signed_by_cert
+        for i, trusted_cert in enumerate(candidates, 1):
             logger.debug(5*'-' +
                          " Certificate.verify_chain - trying trusted #{} : {}"
                          .format(i, trusted_cert.pretty_name()))
-            if self.is_signed_by_cert(trusted_cert):
+            if is_signed_by(self, trusted_cert):
                 # verify expiration of trusted_cert ?
                 if not trusted_cert.x509.has_expired():
                     if debug_verify_chain:
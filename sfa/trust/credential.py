@@ -31,7 +31,6 @@
 
 import os
 import os.path
-import subprocess
 import datetime
 from tempfile import mkstemp
 from xml.dom.minidom import Document, parseString
@@ -45,7 +44,8 @@ from sfa.util.faults import (CredentialNotVerifiable,
 from sfa.util.sfalogging import logger
 from sfa.util.sfatime import utcparse, SFATIME_FORMAT
 from sfa.trust.rights import Right, Rights, determine_rights
-from sfa.trust.gid import GID
+from sfa.trust.gid import GID, gid_from_string
+from sfa.trust.credential_verifier import get_verifier
 from sfa.util.xrn import urn_to_hrn, hrn_authfor_hrn
 
 HAVELXML = False
@@ -790,8 +790,8 @@ class Credential(object):
 
         self.set_refid(cred.getAttribute("xml:id"))
         self.set_expiration(utcparse(getTextNode(cred, "expires")))
-        self.gidCaller = GID(string=getTextNode(cred, "owner_gid"))
-        self.gidObject = GID(string=getTextNode(cred, "target_gid"))
+        self.gidCaller = gid_from_string(getTextNode(cred, "owner_gid"))
+        self.gidObject = gid_from_string(getTextNode(cred, "target_gid"))
 
         # This code until the end of function rewritten by Aaron Helsinger
         # Process privileges
@@ -846,7 +846,8 @@ class Credential(object):
     #
     # Verify that:
     # . All of the signatures are valid and that the issuers trace back
-    #   to trusted roots (performed by xmlsec1)
+    #   to trusted roots (performed in-process or by xmlsec1,
+    #   see sfa.trust.credential_verifier)
     # . The XML matches the credential schema
     # . That the issuer of the credential is the authority in the target's urn
     #    . In the case of a delegated credential, this must be true of the root
@@ -867,8 +868,14 @@ class Credential(object):
     #   must be done elsewhere
     #
     # @param trusted_certs: The certificates of trusted CA certificates
+    # @param verifier: the backend used to check the signatures, either
+    #     a name from sfa.trust.credential_verifier or an instance;
+    #     defaults to the 'auto' backend
+    # @param trusted_cert_objects: the GIDs loaded from trusted_certs, e.g.
+    #     a TrustedCerts store; they are loaded from the files if not provided
     def verify(self, trusted_certs=None, schema=None,
-               trusted_certs_required=True):
+               trusted_certs_required=True, verifier=None,
+               trusted_cert_objects=None):
         if not self.xml:
             self.decode()
 
@@ -889,11 +896,11 @@ class Credential(object):
             trusted_certs = []
 
 #        trusted_cert_objects = [GID(filename=f) for f in trusted_certs]
-        trusted_cert_objects = []
-        ok_trusted_certs = []
         # If caller explicitly passed in None, that means
         # skip cert chain validation. Strange and not typical
-        if trusted_certs is not None:
+        if trusted_certs is not None and trusted_cert_objects is None:
+            trusted_cert_objects = []
+            ok_trusted_certs = []
             for f in trusted_certs:
                 try:
                     # Failures here include unreadable files
@@ -904,6 +911,8 @@ class Credential(object):
                     logger.exception(
                         "Failed to load trusted cert from {}".format(f))
             trusted_certs = ok_trusted_certs
+        if trusted_cert_objects is None:
+            trusted_cert_objects = []
 
         # make sure it is not expired
         if self.get_expiration() < datetime.datetime.utcnow():
@@ -912,9 +921,6 @@ class Credential(object):
                 .format(self.pretty_cred(),
                         self.expiration.strftime(SFATIME_FORMAT)))
 
-        # Verify the signatures
-        filename = self.save_to_random_tmp_file()
-
         # If caller explicitly passed in None that means
         # skip cert chain validation. Strange and not typical
         if trusted_certs is not None:
@@ -936,52 +942,13 @@ class Credential(object):
         for ref in parentRefs:
             refs.append("Sig_{}".format(ref))
 
-        for ref in refs:
-            # If caller explicitly passed in None that means
-            # skip xmlsec1 validation. Strange and not typical
-            if trusted_certs is None:
-                break
-
-            # Thierry - jan 2015
-            # up to fedora20 we used os.popen and checked
-            # that the output begins with OK; turns out, with fedora21,
-            # there is extra input before this 'OK' thing
-            # looks like we're better off just using the exit code
-            # that's what it is made for
-            # cert_args = " ".join(['--trusted-pem {}'.format(x) for x in trusted_certs])
-            # command = '{} --verify --node-id "{}" {} {} 2>&1'.\
-            #          format(self.xmlsec_path, ref, cert_args, filename)
-            xmlsec1 = self.get_xmlsec1_path()
-            if not xmlsec1:
-                raise Exception("Could not locate required 'xmlsec1' program")
-            command = [xmlsec1, '--verify', '--node-id', ref]
-            for trusted in trusted_certs:
-                command += ["--trusted-pem", trusted]
-            command += [filename]
-            logger.debug("Running " + " ".join(command))
-            try:
-                verified = subprocess.check_output(
-                    command, stderr=subprocess.STDOUT)
-                logger.debug("xmlsec command returned {}".format(verified))
-                if "OK\n" not in verified:
-                    logger.warning(
-                        "WARNING: xmlsec1 seemed to return fine but without a OK in its output")
-            except subprocess.CalledProcessError as e:
-                verified = e.output
-                # xmlsec errors have a msg= which is the interesting bit.
-                mstart = verified.find("msg=")
-                msg = ""
-                if mstart > -1 and len(verified) > 4:
-                    mstart = mstart + 4
-                    mend = verified.find('\\', mstart)
-                    msg = verified[mstart:mend]
-                logger.warning(
-                    "Credential.verify - failed - xmlsec1 returned {}"
-                    .format(verified.strip()))
-                raise CredentialNotVerifiable(
-                    "xmlsec1 error verifying cred {} using Signature ID {}: {}"
-                    .format(self.pretty_cred(), ref, msg))
-        os.remove(filename)
+        # Verify the signatures
+        # If caller explicitly passed in None that means
+        # skip signature validation. Strange and not typical
+        if trusted_certs is not None:
+            if verifier is None or isinstance(verifier, str):
+                verifier = get_verifier(verifier)
+            verifier.verify(self, refs, trusted_certs, trusted_cert_objects)
 
         # Verify the parents (delegation)
         if self.parent:
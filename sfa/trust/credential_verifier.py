@@ -0,0 +1,379 @@
+#
+# Backends for checking the XML-DSig signatures on a signed-credential
+#
+# Credential.verify() used to fork 'xmlsec1 --verify' once per signature
+# reference (the credential itself plus every delegated parent), after
+# writing the credential to a temporary file. This module keeps that
+# behaviour as the 'xmlsec1' backend, and adds a 'builtin' backend that
+# checks the signatures in-process, using lxml for canonicalization and
+# the issuer GIDs that Credential.decode() has already loaded.
+#
+# The 'auto' backend (the default) uses the builtin one when lxml and
+# M2Crypto are available, and falls back to xmlsec1 for signatures using
+# algorithms or transforms that the builtin backend does not implement.
+#
+
+import os
+import base64
+import hashlib
+import subprocess
+
+from sfa.util.faults import SfaFault, CredentialNotVerifiable
+from sfa.util.sfalogging import logger
+
+HAVELXML = False
+try:
+    from lxml import etree
+    HAVELXML = True
+except:
+    pass
+
+DSIG_NS = "http://www.w3.org/2000/09/xmldsig#"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# canonicalization algorithms -> (exclusive, with_comments)
+C14N_ALGORITHMS = {
+    "http://www.w3.org/TR/2001/REC-xml-c14n-20010315": (False, False),
+    "http://www.w3.org/TR/2001/REC-xml-c14n-20010315#WithComments":
+        (False, True),
+    "http://www.w3.org/2001/10/xml-exc-c14n#": (True, False),
+    "http://www.w3.org/2001/10/xml-exc-c14n#WithComments": (True, True),
+}
+
+ENVELOPED_SIGNATURE = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+
+DIGEST_ALGORITHMS = {
+    "http://www.w3.org/2000/09/xmldsig#sha1": "sha1",
+    "http://www.w3.org/2001/04/xmlenc#sha256": "sha256",
+    "http://www.w3.org/2001/04/xmldsig-more#sha384": "sha384",
+    "http://www.w3.org/2001/04/xmlenc#sha512": "sha512",
+}
+
+SIGNATURE_ALGORITHMS = {
+    "http://www.w3.org/2000/09/xmldsig#rsa-sha1": "sha1",
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256": "sha256",
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha384": "sha384",
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha512": "sha512",
+}
+
+
+class VerifierUnsupported(Exception):
+    """
+    Raised by a backend that cannot handle a given signature; this is not
+    a verification failure, and the 'auto' backend then tries xmlsec1
+    """
+    pass
+
+
+def _dsig(tag):
+    return "{{{}}}{}".format(DSIG_NS, tag)
+
+
+class Xmlsec1Verifier:
+    """
+    Verify signatures by running 'xmlsec1 --verify' on each reference
+    """
+
+    name = 'xmlsec1'
+
+    def verify(self, credential, refs, trusted_certs, trusted_cert_objects):
+        # circular import otherwise
+        from sfa.trust.credential import Credential
+        xmlsec1 = Credential.get_xmlsec1_path()
+        if not xmlsec1:
+            raise Exception("Could not locate required 'xmlsec1' program")
+        filename = credential.save_to_random_tmp_file()
+        try:
+            for ref in refs:
+                # Thierry - jan 2015
+                # up to fedora20 we used os.popen and checked
+                # that the output begins with OK; turns out, with fedora21,
+                # there is extra input before this 'OK' thing
+                # looks like we're better off just using the exit code
+                # that's what it is made for
+                command = [xmlsec1, '--verify', '--node-id', ref]
+                for trusted in trusted_certs:
+                    command += ["--trusted-pem", trusted]
+                command += [filename]
+                logger.debug("Running " + " ".join(command))
+                try:
+                    verified = subprocess.check_output(
+                        command, stderr=subprocess.STDOUT,
+                        universal_newlines=True)
+                    logger.debug(
+                        "xmlsec command returned {}".format(verified))
+                    if "OK\n" not in verified:
+                        logger.warning(
+                            "WARNING: xmlsec1 seemed to return fine "
+                            "but without a OK in its output")
+                except subprocess.CalledProcessError as e:
+                    verified = e.output
+                    # xmlsec errors have a msg= which is the interesting bit.
+                    mstart = verified.find("msg=")
+                    msg = ""
+                    if mstart > -1 and len(verified) > 4:
+                        mstart = mstart + 4
+                        mend = verified.find('\\', mstart)
+                        msg = verified[mstart:mend]
+                    logger.warning(
+                        "Credential.verify - failed - xmlsec1 returned {}"
+                        .format(verified.strip()))
+                    raise CredentialNotVerifiable(
+                        "xmlsec1 error verifying cred {} "
+                        "using Signature ID {}: {}"
+                        .format(credential.pretty_cred(), ref, msg))
+        finally:
+            os.remove(filename)
+
+
+class BuiltinVerifier:
+    """
+    Verify signatures in-process
+
+    For each reference, this checks the digest of every <Reference>
+    in the <SignedInfo>, then the <SignatureValue> against the public key
+    of the signer GID, and finally that this signer GID chains up to
+    one of the trusted roots - which is what xmlsec1 does with the
+    --trusted-pem certificates.
+    """
+
+    name = 'builtin'
+
+    @staticmethod
+    def available():
+        if not HAVELXML:
+            return False
+        try:
+            import M2Crypto
+            return True
+        except ImportError:
+            return False
+
+    def verify(self, credential, refs, trusted_certs, trusted_cert_objects):
+        if not self.available():
+            raise VerifierUnsupported("lxml or M2Crypto not available")
+        root = self.parse(credential.save_to_string())
+        signers = {"Sig_{}".format(cur_cred.get_refid()): cur_cred
+                   for cur_cred in credential.get_credential_list()}
+        for ref in refs:
+            try:
+                self.verify_reference(root, ref, signers.get(ref),
+                                      trusted_cert_objects)
+            except (SfaFault, VerifierUnsupported):
+                raise
+            except Exception as e:
+                logger.log_exc("BuiltinVerifier: unexpected error on {}"
+                               .format(ref))
+                raise CredentialNotVerifiable(
+                    "error verifying cred {} using Signature ID {}: {}"
+                    .format(credential.pretty_cred(), ref, e))
+
+    @staticmethod
+    def parse(xml):
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        parser = etree.XMLParser(resolve_entities=False, no_network=True)
+        return etree.fromstring(xml, parser)
+
+    def verify_reference(self, root, ref, signed_cred, trusted_cert_objects):
+        def failed(message):
+            return CredentialNotVerifiable(
+                "error verifying cred {} using Signature ID {}: {}"
+                .format(signed_cred.pretty_cred() if signed_cred else '?',
+                        ref, message))
+
+        signatures = self.find_by_id(root, ref)
+        if len(signatures) != 1 or signatures[0].tag != _dsig("Signature"):
+            raise failed("expected exactly one Signature node with this id, "
+                         "found {}".format(len(signatures)))
+        signature = signatures[0]
+        if signed_cred is None or signed_cred.get_signature() is None:
+            raise failed("no credential is signed by this Signature node")
+
+        signed_info = signature.find(_dsig("SignedInfo"))
+        if signed_info is None:
+            raise failed("missing SignedInfo")
+
+        # check the digest of each reference
+        references = signed_info.findall(_dsig("Reference"))
+        if not references:
+            raise failed("no Reference in SignedInfo")
+        for reference in references:
+            self.check_digest(root, signature, reference, failed)
+
+        # check the signature value itself
+        c14n_method = signed_info.find(_dsig("CanonicalizationMethod"))
+        signature_method = signed_info.find(_dsig("SignatureMethod"))
+        if c14n_method is None or signature_method is None:
+            raise failed("incomplete SignedInfo")
+        signed_bytes = self.canonicalize(
+            signed_info, c14n_method.get("Algorithm"))
+        md = SIGNATURE_ALGORITHMS.get(signature_method.get("Algorithm"))
+        if md is None:
+            raise VerifierUnsupported(
+                "signature method {}".format(signature_method.get("Algorithm")))
+        value = signature.find(_dsig("SignatureValue"))
+        if value is None or not value.text:
+            raise failed("missing SignatureValue")
+        signature_value = base64.b64decode("".join(value.text.split()))
+
+        signer_gid = signed_cred.get_signature().get_issuer_gid()
+        if not self.check_signature(signer_gid, md,
+                                    signed_bytes, signature_value):
+            raise failed("signature value does not match signer {}"
+                         .format(signer_gid.pretty_cert()))
+
+        # last, the signer must be trusted; this fails the same way
+        # as with xmlsec1, whatever the reason
+        try:
+            signer_gid.verify_chain(trusted_cert_objects)
+        except SfaFault as e:
+            raise failed("signer {} is not trusted: {}"
+                         .format(signer_gid.get_hrn(), e))
+
+    def check_digest(self, root, signature, reference, failed):
+        uri = reference.get("URI")
+        if uri is None or uri == "":
+            target = root
+        elif uri.startswith("#"):
+            targets = self.find_by_id(root, uri[1:])
+            if len(targets) != 1:
+                raise failed("reference {} matches {} nodes"
+                             .format(uri, len(targets)))
+            target = targets[0]
+        else:
+            raise VerifierUnsupported("reference URI {}".format(uri))
+
+        transforms = reference.find(_dsig("Transforms"))
+        algorithms = []
+        if transforms is not None:
+            algorithms = [transform.get("Algorithm") for transform
+                          in transforms.findall(_dsig("Transform"))]
+
+        # the enveloped signature transform is only meaningful when
+        # the signature is inside the referenced node
+        if ENVELOPED_SIGNATURE in algorithms:
+            algorithms.remove(ENVELOPED_SIGNATURE)
+            if signature in target.iterdescendants():
+                target = self.without_signature(root, target, signature)
+        if len(algorithms) > 1:
+            raise VerifierUnsupported("transforms {}".format(algorithms))
+        # no c14n transform means the default inclusive c14n
+        if algorithms:
+            algorithm = algorithms[0]
+        else:
+            algorithm = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+        octets = self.canonicalize(target, algorithm)
+
+        digest_method = reference.find(_dsig("DigestMethod"))
+        digest_value = reference.find(_dsig("DigestValue"))
+        if digest_method is None or digest_value is None \
+           or not digest_value.text:
+            raise failed("incomplete Reference {}".format(uri))
+        hash_name = DIGEST_ALGORITHMS.get(digest_method.get("Algorithm"))
+        if hash_name is None:
+            raise VerifierUnsupported(
+                "digest method {}".format(digest_method.get("Algorithm")))
+        digest = hashlib.new(hash_name, octets).digest()
+        expected = base64.b64decode("".join(digest_value.text.split()))
+        if digest != expected:
+            raise failed("digest mismatch on reference {}".format(uri))
+
+    @staticmethod
+    def find_by_id(root, id):
+        return root.xpath("//*[@xml:id=$id]", id=id,
+                          namespaces={'xml': XML_NS})
+
+    @staticmethod
+    def canonicalize(element, algorithm):
+        if algorithm not in C14N_ALGORITHMS:
+            raise VerifierUnsupported("canonicalization {}".format(algorithm))
+        exclusive, with_comments = C14N_ALGORITHMS[algorithm]
+        return etree.tostring(element, method="c14n", exclusive=exclusive,
+                              with_comments=with_comments)
+
+    @staticmethod
+    def without_signature(root, target, signature):
+        """
+        Return the node corresponding to target, in a copy of the document
+        where the signature node has been removed
+        """
+        tree = root.getroottree()
+        target_path = tree.getpath(target)
+        signature_path = tree.getpath(signature)
+        copy = BuiltinVerifier.parse(etree.tostring(tree))
+        removed = copy.xpath(signature_path)[0]
+        # preserve the text that follows the removed node
+        if removed.tail:
+            previous = removed.getprevious()
+            parent = removed.getparent()
+            if previous is not None:
+                previous.tail = (previous.tail or "") + removed.tail
+            else:
+                parent.text = (parent.text or "") + removed.tail
+        removed.getparent().remove(removed)
+        return copy.xpath(target_path)[0]
+
+    @staticmethod
+    def check_signature(signer_gid, md, data, signature_value):
+        # get_pubkey returns a fresh M2Crypto key, that we can reset
+        # without affecting other users of this GID
+        m2key = signer_gid.get_pubkey().get_m2_pubkey()
+        m2key.reset_context(md=md)
+        m2key.verify_init()
+        m2key.verify_update(data)
+        return m2key.verify_final(signature_value) == 1
+
+
+class AutoVerifier:
+    """
+    Use the builtin backend when possible, and xmlsec1 otherwise
+    """
+
+    name = 'auto'
+
+    def __init__(self):
+        self.builtin = BuiltinVerifier()
+        self.xmlsec1 = Xmlsec1Verifier()
+
+    def verify(self, credential, refs, trusted_certs, trusted_cert_objects):
+        if self.builtin.available():
+            try:
+                return self.builtin.verify(credential, refs, trusted_certs,
+                                           trusted_cert_objects)
+            except VerifierUnsupported as e:
+                logger.info("builtin credential verifier: {} "
+                            "- falling back to xmlsec1".format(e))
+        return self.xmlsec1.verify(credential, refs, trusted_certs,
+                                   trusted_cert_objects)
+
+
+verifiers = {
+    verifier_class.name: verifier_class
+    for verifier_class in (AutoVerifier, BuiltinVerifier, Xmlsec1Verifier)
+}
+
+default_verifier_name = 'auto'
+
+
+def check_verifier_name(name):
+    if name not in verifiers:
+        raise ValueError("unknown credential verifier {} - known are {}"
+                         .format(name, list(verifiers.keys())))
+
+
+def set_default_verifier(name):
+    global default_verifier_name
+    check_verifier_name(name)
+    default_verifier_name = name
+
+
+def get_verifier(name=None):
+    """
+    Return an instance of the verifier backend by that name, or of the
+    default one; an unknown name raises ValueError
+    """
+    if name is None:
+        name = default_verifier_name
+    check_verifier_name(name)
+    return verifiers[name]()
@@ -28,6 +28,7 @@
 
 
 import uuid
+import hashlib
 import xmlrpc.client
 
 from sfa.trust.certificate import Certificate
@@ -35,6 +36,11 @@ from sfa.trust.certificate import Certificate
 from sfa.util.faults import GidInvalidParentHrn, GidParentHrn
 from sfa.util.xrn import hrn_to_urn, urn_to_hrn, hrn_authfor_hrn
 from sfa.util.sfalogging import logger
+from sfa.util.cache import LRUCache
+
+# GIDs parsed from a string, keyed by a digest of the string,
+# shared by the whole process; see gid_from_string
+parsed_gids = LRUCache(max_size=1000, name='parsed_gids')
 
 ##
 # Create a new uuid. Returns the UUID as a string.
@@ -273,3 +279,23 @@ class GID(Certificate):
                 raise GidInvalidParentHrn(
                     "This cert {}'s trusted root signer {} is not an authority (is a {})"
                     .format(self.get_hrn(), trusted_hrn, trusted_type))
+
+
+##
+# Same as GID(string=string), except that a given string is parsed
+# only once in the process; the same identities - the callers, their
+# authorities, their slices - show up over and over in the records and
+# in the credentials
+#
+# The returned object is shared, so it must not be modified; none of
+# the get_*() or verify_*() methods do.
+
+def gid_from_string(string):
+    if isinstance(string, bytes):
+        string = string.decode()
+    key = hashlib.sha256(string.encode()).hexdigest()
+    gid = parsed_gids.get(key)
+    if gid is None:
+        gid = GID(string=string)
+        parsed_gids.add(key, gid)
+    return gid
@@ -1,7 +1,11 @@
 import os.path
 import glob
+import hashlib
+
+import OpenSSL
 
 from sfa.trust.gid import GID
+from sfa.util.cache import LRUCache
 from sfa.util.sfalogging import logger
 
 
@@ -27,6 +31,9 @@ class TrustedRoots:
                     for cert_file in self.get_file_list()]
         return gid_list
 
+    def get_store(self):
+        return TrustedCerts(self.get_list())
+
     def get_file_list(self):
         file_list = []
         pattern = os.path.join(self.basedir, "*")
@@ -43,3 +50,83 @@ class TrustedRoots:
         _, ext = os.path.splitext(path)
         ext = ext.replace('.', '').lower()
         return ext in TrustedRoots.supported_extensions
+
+
+class TrustedCerts:
+    """
+    A read-only collection of trusted certificates, typically
+    the GIDs found in the trusted roots directory
+
+    It can be used wherever a list of trusted certs is expected,
+    and in particular by Certificate.verify_chain(), which then
+    (*) only tries the roots whose subject is the issuer of the cert
+        at hand, instead of each and every root
+    (*) uses the roots public keys, that are parsed only once
+    (*) parses each cert to check into an M2Crypto object only once
+    (*) does not check again signatures that were already verified
+    """
+
+    def __init__(self, certs=None, max_verified=1000):
+        self.certs = list(certs) if certs else []
+        # subject (DER-encoded) -> list of certs
+        self.by_subject = {}
+        for cert in self.certs:
+            self.by_subject.setdefault(
+                cert.x509.get_subject().der(), []).append(cert)
+        # id(cert) -> Keypair; certs are kept alive by self.certs
+        self.pubkeys = {}
+        # a signature does not change over time, the expiration
+        # dates are checked by verify_chain() every time
+        self.verified = LRUCache(max_size=max_verified, ttl=24 * 60 * 60)
+        # digest -> M2Crypto X509 object, for the certs that get checked
+        # against several roots, or that did not check out
+        self.m2certs = LRUCache(max_size=max_verified, ttl=24 * 60 * 60)
+
+    def __iter__(self):
+        return iter(self.certs)
+
+    def __len__(self):
+        return len(self.certs)
+
+    def __getitem__(self, index):
+        return self.certs[index]
+
+    def issuers_of(self, cert):
+        """
+        The trusted certs whose subject is the issuer of cert
+        """
+        return self.by_subject.get(cert.x509.get_issuer().der(), [])
+
+    def get_pubkey(self, trusted_cert):
+        pubkey = self.pubkeys.get(id(trusted_cert))
+        if pubkey is None:
+            pubkey = trusted_cert.get_pubkey()
+            self.pubkeys[id(trusted_cert)] = pubkey
+        return pubkey
+
+    def get_m2cert(self, digest, der):
+        m2cert = self.m2certs.get(digest)
+        if m2cert is None:
+            import M2Crypto.X509
+            m2cert = M2Crypto.X509.load_cert_der_string(der)
+            self.m2certs.add(digest, m2cert)
+        return m2cert
+
+    def is_signed_by(self, cert, trusted_cert):
+        """
+        Same as cert.is_signed_by_cert(trusted_cert), with the outcome
+        remembered for certs that check out
+        """
+        der = OpenSSL.crypto.dump_certificate(
+            OpenSSL.crypto.FILETYPE_ASN1, cert.x509)
+        digest = hashlib.sha256(der).hexdigest()
+        key = (digest, id(trusted_cert))
+        if self.verified.get(key):
+            return True
+        # same as cert.verify(), without serializing and parsing
+        # cert again, nor converting the root's public key
+        m2pubkey = self.get_pubkey(trusted_cert).get_m2_pubkey()
+        result = self.get_m2cert(digest, der).verify(m2pubkey) == 1
+        if result:
+            self.verified.add(key, True)
+        return result
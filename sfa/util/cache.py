@@ -2,11 +2,20 @@
 # This module implements general purpose caching system
 #
 
+import os
+import json
+import zlib
 import time
+import socket
+import hashlib
+import tempfile
 import threading
 import pickle
+from collections import OrderedDict
 from datetime import datetime
 
+from sfa.util.sfalogging import logger
+
 # maximum lifetime of cached data (in seconds)
 DEFAULT_CACHE_TTL = 60 * 60
 
@@ -114,3 +123,319 @@ class Cache:
     def load_from_file(self, filename):
         f = open(filename, 'rb')
         self.cache = pickle.load(f)
+
+
+class FileCache:
+    """
+    A cache that stores each entry in its own file in a directory
+
+    Unlike Cache, entries are visible to all the processes that use
+    the same directory, and survive a restart. Writes go through a
+    temporary file that is renamed, so readers never see partial data.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        # several processes may get there at the same time
+        os.makedirs(self.dirname, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(
+            self.dirname,
+            hashlib.sha1(str(key).encode()).hexdigest() + ".cache")
+
+    def add(self, key, value, ttl=DEFAULT_CACHE_TTL):
+        self.sweep()
+        expires = time.time() + ttl
+        fd, tmpname = tempfile.mkstemp(dir=self.dirname, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((expires, key, value), f)
+            # so that sweep() does not need to open the files
+            os.utime(tmpname, (expires, expires))
+            os.replace(tmpname, self.filename(key))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self.filename(key), 'rb') as f:
+                expires, stored_key, value = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError):
+            return None
+        if stored_key != key:
+            return None
+        if time.time() > expires:
+            self.pop(key)
+            return None
+        return value
+
+    def pop(self, key):
+        try:
+            os.unlink(self.filename(key))
+        except OSError:
+            pass
+
+    def sweep(self):
+        """
+        Removes the files of the expired entries, that get() would
+        ignore anyway; the modification time of a file is its expiration
+        """
+        now = time.time()
+        for entry in os.scandir(self.dirname):
+            if not entry.name.endswith(".cache"):
+                continue
+            try:
+                if entry.stat().st_mtime < now:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+class LRUCache:
+    """
+    A thread-safe cache with a bounded number of entries
+
+    Each entry has its own expiration time; when the cache is full the
+    least recently used entry gets evicted. Lookups are counted so that
+    the effect of the cache can be observed with stats().
+
+    All instances that are given a name are registered in
+    LRUCache.instances, so their stats can be collected in one place;
+    the servers log them periodically, see SFA_SERVER_STATS_INTERVAL.
+    """
+
+    instances = {}
+
+    def __init__(self, max_size=1000, ttl=DEFAULT_CACHE_TTL, name=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        # key -> (expires, value), most recently used last
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name:
+            LRUCache.instances[name] = self
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if time.time() > expires:
+                del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def add(self, key, value, ttl=None, expires=None):
+        """
+        The entry expires after ttl seconds (defaults to the cache ttl),
+        or at the absolute time expires if that comes first
+        """
+        if self.max_size <= 0:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        deadline = time.time() + ttl
+        if expires is not None:
+            deadline = min(deadline, expires)
+        with self.lock:
+            self.entries[key] = (deadline, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # callers test 'if cache:' to see if caching is enabled,
+    # an empty cache must not look disabled
+    def __bool__(self):
+        return True
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() <= entry[0]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.,
+            }
+
+    @staticmethod
+    def all_stats():
+        return [cache.stats() for cache in LRUCache.instances.values()]
+
+
+class MemcachedCache:
+    """
+    A cache kept in a memcached server - or any server speaking the
+    memcached text protocol - so that it is shared by all the processes
+    using that server and survives their restarts
+
+    The server being unreachable is not an error, this simply
+    behaves as an empty cache then.
+
+    Values are stored as json, so they must be made of strings, numbers,
+    lists and dicts - like an rspec; nothing read from the server gets
+    unpickled. Values larger than compress_threshold bytes are stored
+    zlib-compressed, since memcached turns down items over 1MB by default.
+    """
+
+    # memcached flag set on compressed items
+    FLAG_ZLIB = 1
+    compress_threshold = 16 * 1024
+
+    def __init__(self, server='127.0.0.1:11211', prefix='sfa', timeout=2):
+        host, _, port = server.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self.prefix = prefix
+        self.timeout = timeout
+        # one connection per thread
+        self.local = threading.local()
+
+    def memcached_key(self, key):
+        # memcached keys are limited to 250 chars with no whitespace
+        return "{}:{}".format(
+            self.prefix, hashlib.sha1(str(key).encode()).hexdigest())
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection(self.address, self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self.local.conn = conn
+        return conn
+
+    def disconnect(self):
+        conn = getattr(self.local, 'conn', None)
+        self.local.conn = None
+        if conn is not None:
+            for item in reversed(conn):
+                try:
+                    item.close()
+                except OSError:
+                    pass
+
+    def command(self, line, data=None):
+        """
+        send one command and return the reader, or None on failure
+        """
+        try:
+            sock, reader = self.connection()
+            payload = line.encode() + b"\r\n"
+            if data is not None:
+                payload += data + b"\r\n"
+            sock.sendall(payload)
+            return reader
+        except OSError as e:
+            logger.debug("MemcachedCache: cannot reach {}: {}"
+                         .format(self.address, e))
+            self.disconnect()
+            return None
+
+    def add(self, key, value, ttl=DEFAULT_CACHE_TTL):
+        data = json.dumps([str(key), value]).encode()
+        flags = 0
+        if len(data) > self.compress_threshold:
+            data = zlib.compress(data)
+            flags |= self.FLAG_ZLIB
+        reader = self.command("set {} {} {} {}".format(
+            self.memcached_key(key), flags, int(ttl), len(data)), data)
+        if reader is None:
+            return
+        try:
+            reply = reader.readline()
+        except OSError:
+            self.disconnect()
+            return
+        if reply != b"STORED\r\n":
+            # e.g. SERVER_ERROR object too large for cache
+            logger.warning("MemcachedCache: {} refused to store {} "
+                           "({} bytes): {}".format(
+                               self.address, key, len(data),
+                               reply.decode(errors='replace').strip()))
+
+    def get(self, key):
+        reader = self.command("get {}".format(self.memcached_key(key)))
+        if reader is None:
+            return None
+        try:
+            line = reader.readline()
+            if not line.startswith(b"VALUE "):
+                return None
+            _, _, flags, length = line.split()[:4]
+            data = reader.read(int(length) + 2)[:-2]
+            # trailing END
+            reader.readline()
+        except (OSError, ValueError):
+            self.disconnect()
+            return None
+        try:
+            if int(flags) & self.FLAG_ZLIB:
+                data = zlib.decompress(data)
+            stored_key, value = json.loads(data.decode())
+        except (ValueError, TypeError, zlib.error):
+            return None
+        return value if stored_key == str(key) else None
+
+    def pop(self, key):
+        reader = self.command("delete {}".format(self.memcached_key(key)))
+        if reader is None:
+            return
+        try:
+            reader.readline()
+        except OSError:
+            self.disconnect()
+
+
+# the available backends for the advertisement cache
+# all have add(key, value, ttl) / get(key) / pop(key)
+cache_backends = ['memory', 'file', 'memcached']
+
+
+def make_cache(backend, name=None, dirname=None, server=None, max_size=100):
+    """
+    Create a cache with the given backend
+
+    (*) 'memory' is a LRUCache of max_size entries, local to the process
+    (*) 'file' is a FileCache in dirname
+    (*) 'memcached' is a MemcachedCache on server, with name as a prefix
+    """
+    if backend == 'memory':
+        return LRUCache(max_size=max_size, name=name)
+    if backend == 'file':
+        return FileCache(dirname)
+    if backend == 'memcached':
+        return MemcachedCache(server or '127.0.0.1:11211',
+                              prefix=name or 'sfa')
+    raise ValueError("unknown cache backend {} - should be one of {}"
+                     .format(backend, cache_backends))
@@ -152,8 +152,9 @@ class XmlElement:
     def unset(self, key):
         del self.element.attrib[key]
 
-    def toxml(self):
-        return etree.tostring(self.element, encoding='UTF-8', pretty_print=True)
+    def toxml(self, pretty_print=True):
+        return etree.tostring(self.element, encoding='unicode',
+                              pretty_print=pretty_print)
 
     def __str__(self):
         return self.toxml()
@@ -340,8 +341,9 @@ class XML:
     def __str__(self):
         return self.toxml()
 
-    def toxml(self):
-        return etree.tostring(self.root.element, encoding='UTF-8', pretty_print=True)
+    def toxml(self, pretty_print=True):
+        return etree.tostring(self.root.element, encoding='unicode',
+                              pretty_print=pretty_print)
 
     # XXX smbaker, for record.load_from_string
     def todict(self, elem=None):
@@ -0,0 +1,23 @@
+"""
+GIDs for the tests, made up on the fly
+"""
+from sfa.util.xrn import hrn_to_urn
+from sfa.trust.gid import GID, create_uuid
+
+def make_gid(hrn, type, key, issuer_key=None, issuer_gid=None):
+    """
+    a GID for hrn with public key key, signed by issuer_key and chained
+    to issuer_gid; without an issuer, a self-signed authority
+    """
+    gid = GID(subject=hrn, uuid=create_uuid(), hrn=hrn)
+    gid.set_urn(hrn_to_urn(hrn, type))
+    gid.set_pubkey(key)
+    if issuer_gid:
+        gid.set_issuer(issuer_key, cert=issuer_gid)
+        gid.set_parent(issuer_gid)
+    else:
+        gid.set_issuer(key, subject=hrn)
+    gid.set_intermediate_ca(issuer_gid is None)
+    gid.encode()
+    gid.sign()
+    return gid
@@ -7,12 +7,18 @@ from testXrn import *
 #from testCert import *
 # xxx broken-test
 #from testGid import *
+from testGid import TestGidFromString
 # xxx broken-test
 #from testCred import *
+from testCredentialVerifier import *
 from testKeypair import *
 # xxx broken-test
 #from testHierarchy import *
 from testStorage import *
+from testCache import *
+from testTrustedRoots import *
+from testPlShell import *
+from testRegistryManager import *
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from sfa.util.cache import LRUCache, FileCache, make_cache
+
+class TestLRUCache(unittest.TestCase):
+
+    def testGetAdd(self):
+        cache = LRUCache(max_size=10)
+        self.assertEqual(cache.get('a'), None)
+        cache.add('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def testEviction(self):
+        cache = LRUCache(max_size=2)
+        cache.add('a', 1)
+        cache.add('b', 2)
+        # 'a' becomes the most recently used
+        cache.get('a')
+        cache.add('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def testExpiration(self):
+        cache = LRUCache(max_size=10, ttl=60)
+        cache.add('ttl', 1, ttl=-1)
+        cache.add('expires', 2, expires=time.time() - 1)
+        cache.add('alive', 3)
+        self.assertEqual(cache.get('ttl'), None)
+        self.assertEqual(cache.get('expires'), None)
+        self.assertEqual(cache.get('alive'), 3)
+
+    def testDisabled(self):
+        cache = LRUCache(max_size=0)
+        cache.add('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def testShared(self):
+        FileCache(self.dirname).add('rspec', '<rspec/>')
+        # another instance - e.g. in another process - sees the entry
+        cache = FileCache(self.dirname)
+        self.assertEqual(cache.get('rspec'), '<rspec/>')
+        self.assertEqual(cache.get('other'), None)
+
+    def testExpiration(self):
+        cache = FileCache(self.dirname)
+        cache.add('a', 1, ttl=-1)
+        self.assertEqual(cache.get('a'), None)
+
+    def testSweep(self):
+        cache = FileCache(self.dirname)
+        cache.add('expired', 1, ttl=-1)
+        cache.add('alive', 2)
+        # the expired entry, never read again, is not left behind
+        self.assertEqual(os.listdir(self.dirname),
+                         [os.path.basename(cache.filename('alive'))])
+        self.assertEqual(cache.get('alive'), 2)
+
+    def testMakeCache(self):
+        self.assertTrue(isinstance(make_cache('file', dirname=self.dirname),
+                                   FileCache))
+        self.assertTrue(isinstance(make_cache('memory'), LRUCache))
+        self.assertRaises(ValueError, make_cache, 'nowhere')
+
+if __name__ == "__main__":
+    unittest.main()
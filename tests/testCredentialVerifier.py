@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import os
+import base64
+import shutil
+import hashlib
+import datetime
+import tempfile
+import unittest
+
+from lxml import etree
+
+from sfa.util.faults import CredentialNotVerifiable
+from sfa.trust.certificate import Keypair
+from sfa.trust.credential import Credential
+from sfa.trust.credential_verifier import DSIG_NS, XML_NS, \
+    AutoVerifier, BuiltinVerifier, Xmlsec1Verifier, VerifierUnsupported, \
+    get_verifier, set_default_verifier
+from sfa.trust.auth import Auth
+
+from gids import make_gid
+
+SIGNATURE_TEMPLATE = """\
+<Signature xml:id="Sig_{refid}" xmlns="http://www.w3.org/2000/09/xmldsig#">
+<SignedInfo>
+<CanonicalizationMethod \
+Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
+<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
+<Reference URI="#{refid}">
+<Transforms>
+<Transform \
+Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>
+</Transforms>
+<DigestMethod Algorithm="{digest_method}"/>
+<DigestValue></DigestValue>
+</Reference>
+</SignedInfo>
+<SignatureValue></SignatureValue>
+<KeyInfo><X509Data><X509Certificate></X509Certificate></X509Data></KeyInfo>
+</Signature>"""
+
+def sign(xml, refid, key, gid,
+         digest_method="http://www.w3.org/2000/09/xmldsig#sha1"):
+    """
+    what 'xmlsec1 --sign' does to a credential, done in-process so that
+    the tests do not need xmlsec1 for creating credentials
+    """
+    root = etree.fromstring(xml)
+    signature = etree.fromstring(SIGNATURE_TEMPLATE.format(
+        refid=refid, digest_method=digest_method))
+    root.find('signatures').append(signature)
+    target = root.xpath("//*[@xml:id=$id]", id=refid,
+                        namespaces={'xml': XML_NS})[0]
+    digest = hashlib.sha1(etree.tostring(target, method='c14n')).digest()
+    signature.find('.//{%s}DigestValue' % DSIG_NS).text = \
+        base64.b64encode(digest).decode()
+    signed_info = signature.find('{%s}SignedInfo' % DSIG_NS)
+    m2key = key.get_m2_pubkey()
+    m2key.reset_context(md='sha1')
+    m2key.sign_init()
+    m2key.sign_update(etree.tostring(signed_info, method='c14n'))
+    signature.find('{%s}SignatureValue' % DSIG_NS).text = \
+        base64.b64encode(m2key.sign_final()).decode()
+    pem = gid.save_to_string(save_parents=False)
+    signature.find('.//{%s}X509Certificate' % DSIG_NS).text = \
+        "".join(pem.strip().splitlines()[1:-1])
+    return etree.tostring(root, xml_declaration=True,
+                          encoding='utf-8').decode()
+
+class RecordingVerifier:
+    """
+    stands for xmlsec1 in the tests of the auto backend
+    """
+    def __init__(self):
+        self.calls = []
+
+    def verify(self, credential, refs, trusted_certs, trusted_cert_objects):
+        self.calls.append(refs)
+
+class TestCredentialVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.root_key = Keypair(create=True)
+        self.root = make_gid("plc", "authority", self.root_key)
+        self.user = make_gid("plc.alice", "user", Keypair(create=True),
+                             self.root_key, self.root)
+        self.slice = make_gid("plc.alice_slice", "slice",
+                              Keypair(create=True), self.root_key, self.root)
+        self.dir = tempfile.mkdtemp()
+        self.trusted = os.path.join(self.dir, "plc.gid")
+        self.root.save_to_file(self.trusted)
+        self.xml = self.make_credential()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        set_default_verifier('auto')
+
+    def make_credential(self, signer_key=None, signer=None, **kwds):
+        cred = Credential(subject="testCredentialVerifier")
+        cred.set_gid_caller(self.user)
+        cred.set_gid_object(self.slice)
+        cred.set_expiration(datetime.datetime.utcnow() +
+                            datetime.timedelta(days=1))
+        cred.set_privileges("refresh,embed")
+        cred.encode()
+        return sign(cred.get_xml(), cred.get_refid(),
+                    signer_key or self.root_key, signer or self.root, **kwds)
+
+    def tampered(self):
+        return self.xml.replace("refresh", "resolve")
+
+    def verify(self, xml, verifier):
+        return Credential(string=xml).verify([self.trusted],
+                                             verifier=verifier)
+
+    def testBuiltinAccepts(self):
+        self.assertTrue(self.verify(self.xml, 'builtin'))
+
+    def testBuiltinRejectsTampered(self):
+        self.assertRaises(CredentialNotVerifiable,
+                          self.verify, self.tampered(), 'builtin')
+
+    def testBuiltinRejectsUntrusted(self):
+        # caller and object are fine, but the signer is not trusted
+        other_key = Keypair(create=True)
+        other = make_gid("other", "authority", other_key)
+        xml = self.make_credential(other_key, other)
+        self.assertRaises(CredentialNotVerifiable, self.verify, xml, 'builtin')
+
+    @unittest.skipUnless(Credential.get_xmlsec1_path(), "needs xmlsec1")
+    def testBackendsAgree(self):
+        for xml, valid in ((self.xml, True), (self.tampered(), False)):
+            for name in ('builtin', 'xmlsec1'):
+                if valid:
+                    self.assertTrue(self.verify(xml, name))
+                else:
+                    self.assertRaises(CredentialNotVerifiable,
+                                      self.verify, xml, name)
+
+    def testAutoRejectsTampered(self):
+        auto = AutoVerifier()
+        auto.xmlsec1 = RecordingVerifier()
+        self.assertRaises(CredentialNotVerifiable,
+                          self.verify, self.tampered(), auto)
+        # a signature that does not check is not a reason to try xmlsec1
+        self.assertEqual(auto.xmlsec1.calls, [])
+
+    def testAutoFallsBackOnUnsupported(self):
+        xml = self.make_credential(
+            digest_method="http://www.w3.org/2001/04/xmldsig-more#sha224")
+        self.assertRaises(VerifierUnsupported, self.verify, xml, 'builtin')
+        auto = AutoVerifier()
+        auto.xmlsec1 = RecordingVerifier()
+        self.assertTrue(self.verify(xml, auto))
+        self.assertEqual(len(auto.xmlsec1.calls), 1)
+
+    def testAutoFallsBackWithoutBuiltin(self):
+        auto = AutoVerifier()
+        auto.builtin.available = lambda: False
+        auto.xmlsec1 = RecordingVerifier()
+        self.assertTrue(self.verify(self.xml, auto))
+        self.assertEqual(len(auto.xmlsec1.calls), 1)
+
+    def testGetVerifier(self):
+        self.assertIsInstance(get_verifier(), AutoVerifier)
+        self.assertIsInstance(get_verifier('xmlsec1'), Xmlsec1Verifier)
+        set_default_verifier('builtin')
+        self.assertIsInstance(get_verifier(), BuiltinVerifier)
+
+    def testUnknownVerifier(self):
+        self.assertRaises(ValueError, get_verifier, 'xmlsec')
+        self.assertRaises(ValueError, set_default_verifier, 'xmlsec')
+
+        class Config:
+            SFA_CREDENTIAL_VERIFIER = 'xmlsec'
+        # a typo in the config is turned down right away
+        self.assertRaises(ValueError, Auth, config=Config())
+
+if __name__ == "__main__":
+    unittest.main()
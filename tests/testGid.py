@@ -2,6 +2,8 @@ import unittest
 from sfa.trust.certificate import Keypair
 from sfa.trust.gid import *
 
+from gids import make_gid
+
 class TestGid(unittest.TestCase):
    def setUp(self):
       pass
@@ -58,5 +60,31 @@ class TestGid(unittest.TestCase):
       self.assertEqual(gid.get_hrn(), hrn)
       self.assertEqual(gid.get_uuid(), u)
 
+class TestGidFromString(unittest.TestCase):
+   def setUp(self):
+      root_key = Keypair(create=True)
+      root = make_gid("test", "authority", root_key)
+      gid = make_gid("test.user", "user", Keypair(create=True),
+                     root_key, root)
+      self.string = gid.save_to_string(save_parents=True)
+
+   def testSameObject(self):
+      gid = gid_from_string(self.string)
+      self.assertIs(gid_from_string(self.string), gid)
+      self.assertIs(gid_from_string(self.string.encode()), gid)
+
+   def testSameAsParsed(self):
+      cached = gid_from_string(self.string)
+      parsed = GID(string=self.string)
+      for gid in (cached, parsed):
+         self.assertEqual(gid.get_hrn(), "test.user")
+         self.assertEqual(gid.get_parent().get_hrn(), "test")
+      self.assertEqual(cached.get_uuid(), parsed.get_uuid())
+      self.assertEqual(cached.get_urn(), parsed.get_urn())
+      self.assertEqual(cached.get_pubkey().get_pubkey_string(),
+                       parsed.get_pubkey().get_pubkey_string())
+      self.assertEqual(cached.save_to_string(save_parents=True),
+                       parsed.save_to_string(save_parents=True))
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import threading
+import unittest
+import xmlrpc.client
+from types import SimpleNamespace
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from sfa.planetlab.plshell import PlShell, PlcConnectionPool, PlTablesCache
+
+
+class CountingHandler(SimpleXMLRPCRequestHandler):
+    # keep connections open
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    client_ports = set()
+
+    def do_POST(self):
+        CountingHandler.requests += 1
+        CountingHandler.client_ports.add(self.client_address[1])
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class TestPlShell(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadedXMLRPCServer(('127.0.0.1', 0), CountingHandler,
+                                          logRequests=False, allow_none=True)
+        cls.server.register_multicall_functions()
+
+        def AddPersonToSite(auth, person_id, site_id):
+            return [auth['Username'], person_id, site_id]
+
+        def DeleteKey(auth, key_id):
+            raise xmlrpc.client.Fault(100, "no such key %s" % key_id)
+
+        def GetNodes(auth, filter):
+            return [{'node_id': node_id, 'hostname': 'node%d' % node_id}
+                    for node_id in filter['node_id']]
+        cls.server.register_function(AddPersonToSite)
+        cls.server.register_function(DeleteKey)
+        cls.server.register_function(GetNodes)
+        cls.server.register_function(AddPersonToSite, 'AddNode')
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        config = SimpleNamespace(
+            SFA_PLC_URL="http://127.0.0.1:%d/" % cls.server.server_address[1],
+            SFA_PLC_USER='admin', SFA_PLC_PASSWORD='secret')
+        cls.shell = PlShell(config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.shell.pool.close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def testConnectionReused(self):
+        self.shell.pool.close()
+        CountingHandler.client_ports.clear()
+        for i in range(5):
+            self.assertEqual(self.shell.AddPersonToSite(i, 'site'),
+                             ['admin', i, 'site'])
+        self.assertEqual(len(CountingHandler.client_ports), 1)
+
+    def testPoolShared(self):
+        config = SimpleNamespace(SFA_PLC_URL=self.shell.url,
+                                 SFA_PLC_USER='admin',
+                                 SFA_PLC_PASSWORD='secret')
+        self.assertIs(PlShell(config).pool, self.shell.pool)
+
+    def testPoolSize(self):
+        pool = PlcConnectionPool(self.shell.url, 2, 10)
+        results = []
+
+        def call(i):
+            results.append(pool.call('AddPersonToSite',
+                                     {'Username': 'admin'}, i, 'site'))
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        # never more than 2 proxies were needed
+        self.assertLessEqual(pool.idle.qsize(), 2)
+        pool.close()
+
+    def testTablesCache(self):
+        config = SimpleNamespace(SFA_PLC_URL=self.shell.url,
+                                 SFA_PLC_USER='admin',
+                                 SFA_PLC_PASSWORD='secret')
+        shell = PlShell(config, tables_cache=PlTablesCache())
+        before = CountingHandler.requests
+        nodes = shell.GetNodes({'node_id': [1, 2]})
+        self.assertEqual(len(nodes), 2)
+        # callers can change what they get
+        nodes[0]['hostname'] = 'changed'
+        self.assertEqual(shell.GetNodes({'node_id': [1, 2]})[0]['hostname'],
+                         'node1')
+        self.assertEqual(CountingHandler.requests, before + 1)
+        # another query is another entry
+        shell.GetNodes({'node_id': [3]})
+        self.assertEqual(CountingHandler.requests, before + 2)
+        # writes on the nodes table invalidate it
+        shell.AddNode(1, 'site')
+        shell.GetNodes({'node_id': [1, 2]})
+        self.assertEqual(CountingHandler.requests, before + 4)
+        with shell.batch() as batch:
+            batch.AddNode(1, 'site')
+        shell.GetNodes({'node_id': [1, 2]})
+        self.assertEqual(CountingHandler.requests, before + 6)
+        # other calls are not cached
+        shell.AddPersonToSite(1, 'site')
+        shell.AddPersonToSite(1, 'site')
+        self.assertEqual(CountingHandler.requests, before + 8)
+
+    def testOneRequest(self):
+        before = CountingHandler.requests
+        with self.shell.batch() as batch:
+            calls = [batch.AddPersonToSite(i, 'site') for i in range(5)]
+        self.assertEqual(CountingHandler.requests, before + 1)
+        self.assertEqual([call.result() for call in calls],
+                         [['admin', i, 'site'] for i in range(5)])
+
+    def testFaults(self):
+        with self.assertRaises(xmlrpc.client.Fault):
+            with self.shell.batch() as batch:
+                batch.DeleteKey(1)
+        with self.shell.batch(check=False) as batch:
+            failed = batch.DeleteKey(2)
+            passed = batch.AddPersonToSite(1, 'site')
+        self.assertRaises(xmlrpc.client.Fault, failed.result)
+        self.assertEqual(passed.result(), ['admin', 1, 'site'])
+
+    def testIllegalCall(self):
+        with self.assertRaises(Exception):
+            with self.shell.batch() as batch:
+                batch.system_shutdown()
+
+    def testNotSentOnError(self):
+        before = CountingHandler.requests
+        try:
+            with self.shell.batch() as batch:
+                batch.AddPersonToSite(1, 'site')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(CountingHandler.requests, before)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import datetime
+import itertools
+import unittest
+from unittest import mock
+
+from sfa.trust.rights import Rights
+from sfa.storage.model import RegUser
+from sfa.managers import registry_manager
+from sfa.managers.registry_manager import RegistryManager
+
+class FakeCredential:
+    """
+    what GetCredential needs from a Credential, without the signing
+    """
+    serial = itertools.count(1)
+
+    def __init__(self, subject=None):
+        self.expiration = None
+        self.privileges = None
+        self.string = None
+
+    def set_gid_caller(self, gid):
+        pass
+    set_gid_object = set_gid_caller
+
+    def set_issuer_keys(self, privkey, gid):
+        pass
+
+    def set_privileges(self, rights):
+        self.privileges = rights
+
+    def get_privileges(self):
+        return self.privileges
+
+    def set_expiration(self, expiration):
+        self.expiration = datetime.datetime.utcfromtimestamp(expiration)
+
+    def get_expiration(self):
+        return self.expiration
+
+    def encode(self):
+        if self.expiration is None:
+            self.expiration = datetime.datetime.utcnow() + \
+                datetime.timedelta(days=1)
+
+    def sign(self):
+        self.string = "credential-{}".format(next(self.serial))
+
+    def save_to_string(self, save_parents=True):
+        return self.string
+
+class TestCredentialCache(unittest.TestCase):
+
+    def setUp(self):
+        RegistryManager.issued_credentials.clear()
+        self.record = RegUser(hrn='plc.site.alice', email='alice@site')
+        self.record.last_updated = datetime.datetime(2020, 1, 1)
+        self.record.get_gid_object = mock.Mock()
+        self.api = mock.MagicMock()
+        self.api.config.SFA_INTERFACE_HRN = 'plc'
+        self.api.auth.get_authority.return_value = 'plc.site'
+        # GetCredential changes the rights it is given
+        self.api.auth.determine_user_rights.side_effect = \
+            lambda caller_hrn, record: Rights(string='refresh,resolve')
+        self.api.dbsession().query().filter_by().first.return_value = \
+            self.record
+        patcher = mock.patch.object(registry_manager, 'Credential',
+                                    FakeCredential)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_credential(self, manager):
+        return manager.GetCredential(self.api, 'plc.site.alice', 'user')
+
+    def testReused(self):
+        manager = RegistryManager(object())
+        first = self.get_credential(manager)
+        self.assertEqual(self.get_credential(manager), first)
+
+    def testNewAfterUpdate(self):
+        manager = RegistryManager(object())
+        first = self.get_credential(manager)
+        manager.Update(self.api, {'type': 'user', 'hrn': 'plc.site.alice'})
+        second = self.get_credential(manager)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.get_credential(manager), second)
+
+    def testDisabled(self):
+        class Config:
+            SFA_REGISTRY_CREDENTIAL_CACHE = False
+        manager = RegistryManager(Config())
+        self.assertNotEqual(self.get_credential(manager),
+                            self.get_credential(manager))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,11 @@
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import sqlalchemy
+
 from sfa.trust.gid import *
 from sfa.util.config import *
 from sfa.storage.model import RegRecord
@@ -10,5 +17,52 @@ class TestStorage(unittest.TestCase):
     def testCreate(self):
         r = RegRecord(type='authority',hrn='foo.bar')
 
+class DbConfig:
+    SFA_DB_USER = 'sfa'
+    SFA_DB_PASSWORD = 'sfa'
+    SFA_DB_HOST = 'localhost'
+    SFA_DB_PORT = 5432
+    SFA_DB_POOL_SIZE = 2
+
+class TestThreadSessions(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.dbfile = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        create_engine = sqlalchemy.create_engine
+        # a sqlite file instead of the configured postgresql db;
+        # the alchemy module connects to the db when first imported
+        def sqlite_engine(url, **kwds):
+            return create_engine('sqlite:///' + self.dbfile, **kwds)
+        with mock.patch('sqlalchemy.create_engine', sqlite_engine), \
+             mock.patch('sfa.util.config.Config', DbConfig):
+            from sfa.storage import alchemy
+            with mock.patch.object(alchemy, 'create_engine', sqlite_engine):
+                self.alchemy = alchemy.Alchemy(DbConfig())
+
+    def tearDown(self):
+        self.alchemy.close_all()
+        os.unlink(self.dbfile)
+
+    def testPerThread(self):
+        session = self.alchemy.thread_session()
+        self.assertIs(self.alchemy.thread_session(), session)
+        others = []
+        thread = threading.Thread(
+            target=lambda: others.append(self.alchemy.thread_session()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(others[0], session)
+
+    def testRemove(self):
+        session = self.alchemy.thread_session()
+        session.execute(sqlalchemy.text("select 1"))
+        self.assertEqual(self.alchemy.pool_stats()['checkedout'], 1)
+        self.alchemy.close_thread_session()
+        # the connection is back in the pool, and the next call
+        # gets a new session
+        self.assertEqual(self.alchemy.pool_stats()['checkedout'], 0)
+        self.assertIsNot(self.alchemy.thread_session(), session)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import unittest
+
+from sfa.util.faults import CertMissingParent
+from sfa.trust.certificate import Keypair
+from sfa.trust.trustedroots import TrustedCerts
+
+from gids import make_gid
+
+class TestTrustedCerts(unittest.TestCase):
+
+    def setUp(self):
+        self.root_key = Keypair(create=True)
+        self.root = make_gid("plc", "authority", self.root_key)
+        self.other = make_gid("other", "authority", Keypair(create=True))
+        self.store = TrustedCerts([self.other, self.root])
+
+    def testIssuersOf(self):
+        user = make_gid("plc.alice", "user", Keypair(create=True),
+                        self.root_key, self.root)
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(self.store.issuers_of(user), [self.root])
+
+    def testVerifyChain(self):
+        user = make_gid("plc.alice", "user", Keypair(create=True),
+                        self.root_key, self.root)
+        user.set_parent(None)
+        user.verify_chain(self.store)
+        # the second time around the signature check is remembered
+        user.verify_chain(self.store)
+        self.assertEqual(self.store.verified.stats()['hits'], 1)
+
+    def testParsedOnce(self):
+        user = make_gid("plc.alice", "user", Keypair(create=True),
+                        self.root_key, self.root)
+        self.assertFalse(self.store.is_signed_by(user, self.other))
+        self.assertTrue(self.store.is_signed_by(user, self.root))
+        # the cert was parsed for the first check only
+        self.assertEqual(self.store.m2certs.stats()['misses'], 1)
+
+    def testUntrusted(self):
+        stranger_key = Keypair(create=True)
+        stranger = make_gid("stranger", "authority", stranger_key)
+        user = make_gid("stranger.bob", "user", Keypair(create=True),
+                        stranger_key, stranger)
+        user.set_parent(None)
+        self.assertRaises(CertMissingParent, user.verify_chain, self.store)
+
+if __name__ == "__main__":
+    unittest.main()